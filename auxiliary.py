@@ -1,15 +1,30 @@
+import contextvars
 import datetime
+import io
 from typing import List, Any
 
 import discord
+from sqlalchemy import func, select, true
+from sqlalchemy.dialects import postgresql
 
+import cache
 import configuration as config
+import database
 import models
+import notifications
+import rendering
+import workers
 
 # Names of weekdays in English and Portuguese
 WEEKDAYS_EN = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
 WEEKDAYS_PT = ['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta', 'Sábado', 'Domingo']
 
+# Messages fetched from Discord in the current event, by id
+event_messages = contextvars.ContextVar('event_messages', default=None)
+
+# Worker for the deletion of messages by maintenance jobs
+message_deletions = workers.Worker('message_deletions', config.CONCURRENT_MESSAGE_DELETIONS)
+
 
 def parse_command_parameters(command):
     """
@@ -39,56 +54,413 @@ def parse_command_parameters(command):
     return params
 
 
-def create_message(poll, options):
+def local_servers(discord_server_id_column):
+    """
+    Create a filter for the entries of the servers that belong to the shards run by this process.
+
+    :param discord_server_id_column: the column with the id of the server.
+    :return: the filter.
+    """
+
+    if config.shard_ids is None:
+        return true()
+
+    # The shard of a server is given by Discord's formula
+    return (discord_server_id_column.op('>>')(22) % config.shard_count).in_(config.shard_ids)
+
+
+def get_message(channel_discord_id, discord_message_id):
+    """
+    Get a message that can be edited or deleted, without a request to Discord.
+    It is the message already fetched in this event or a partial message.
+
+    :param channel_discord_id: the id of the discord channel.
+    :param discord_message_id: the id of the message.
+    :return: the message.
+    """
+
+    memo = event_messages.get()
+
+    if memo is not None and discord_message_id in memo:
+        return memo[discord_message_id]
+
+    c = config.client.get_channel(channel_discord_id)
+
+    return c.get_partial_message(discord_message_id)
+
+
+async def fetch_message(channel_discord_id, discord_message_id):
+    """
+    Fetch a message from Discord, at most once in each event.
+
+    :param channel_discord_id: the id of the discord channel.
+    :param discord_message_id: the id of the message.
+    :return: the message.
+    """
+
+    memo = event_messages.get()
+
+    if memo is None:
+        memo = {}
+        event_messages.set(memo)
+
+    if discord_message_id not in memo:
+        c = config.client.get_channel(channel_discord_id)
+        memo[discord_message_id] = await c.fetch_message(discord_message_id)
+
+    return memo[discord_message_id]
+
+
+def get_channel(discord_channel_id):
+    """
+    Get the settings of a Discord channel, from the cache or the DB.
+
+    :param discord_channel_id: the id of the Discord channel.
+    :return: the cache.CachedChannel or None, if the channel is not in the DB.
+    """
+
+    db_channel = cache.channels.get(discord_channel_id)
+
+    if db_channel is not cache.NOT_CACHED:
+        return db_channel
+
+    db_channel = config.session.query(models.Channel).filter(models.Channel.discord_id == discord_channel_id).first()
+
+    return cache.channels.put(discord_channel_id, db_channel)
+
+
+def get_options(poll_id):
+    """
+    Get all options available in a poll, ordered by their position.
+
+    :param poll_id: the id of the poll in the DB.
+    :return: the list of options.
+    """
+
+    return config.session.query(models.Option).filter(models.Option.poll_id == poll_id) \
+        .order_by(models.Option.position).all()
+
+
+def get_votes(options):
+    """
+    Get the participants that voted in each of the options, from the cache or with a single query.
+
+    :param options: the options, all from the same poll.
+    :return: a dictionary with the list of participants of each option, by option id.
+    """
+
+    if len(options) == 0:
+        return {}
+
+    entry = cache.polls.get(options[0].poll_id)
+
+    # Use the cache if it has all options
+    if entry is not None and all(o.id in entry.voters for o in options):
+        return {o.id: list(entry.voters[o.id]) for o in options}
+
+    # Make sure new options already have an id
+    config.session.flush()
+
+    votes = {}
+
+    for o in options:
+        votes[o.id] = []
+
+    for v in config.session.query(models.Vote).filter(models.Vote.option_id.in_(list(votes.keys()))) \
+            .order_by(models.Vote.id).all():
+        # Check the type of participant
+        # int means discord user
+        # string means external participant
+        if v.participant_name:
+            votes[v.option_id].append(v.participant_name)
+        else:
+            votes[v.option_id].append(v.discord_participant_id)
+
+    return votes
+
+
+def get_num_votes(options):
+    """
+    Get the number of votes of each of the options, from the cache or with a single query on the options.
+
+    :param options: the options, all from the same poll.
+    :return: a dictionary with the number of votes of each option, by option id.
+    """
+
+    if len(options) == 0:
+        return {}
+
+    entry = cache.polls.get(options[0].poll_id)
+
+    # Use the cache if it has all options
+    if entry is not None and all(o.id in entry.voters for o in options):
+        return {o.id: len(entry.voters[o.id]) for o in options}
+
+    # Make sure new options already have an id
+    config.session.flush()
+
+    return dict(config.session.query(models.Option.id, models.Option.num_votes)
+                .filter(models.Option.id.in_([o.id for o in options])).all())
+
+
+def get_poll_by_message(discord_message_id):
+    """
+    Get a poll, with its options and votes, using the id of its Discord message.
+    The poll is kept in the cache so that the following reactions do not need the DB.
+
+    :param discord_message_id: the id of the Discord message.
+    :return: the cache.CachedPoll or None, if the message is not a poll.
+    """
+
+    entry = cache.polls.get_by_message(discord_message_id)
+
+    if entry is not None:
+        return entry
+
+    poll = config.session.query(models.Poll).filter(models.Poll.discord_message_id == discord_message_id).first()
+
+    if poll is None:
+        return None
+
+    options = get_options(poll.id)
+
+    return cache.polls.put(poll, options, get_votes(options))
+
+
+def render_poll(poll_id):
+    """
+    Create the message of a poll with its current options and votes, using the cache when possible.
+
+    :param poll_id: the id of the poll in the DB.
+    :return: the message that represents the poll and the id of the current message of the poll or None, if the poll
+    no longer exists.
+    """
+
+    entry = cache.polls.get(poll_id)
+
+    if entry is not None:
+        return create_message(entry, entry.options), entry.discord_message_id
+
+    poll = config.session.query(models.Poll).get(poll_id)
+
+    if poll is None:
+        return None
+
+    return create_message(poll, get_options(poll_id)), poll.discord_message_id
+
+
+def load_poll_messages():
+    """Load the index of the messages of all polls."""
+
+    cache.poll_messages.load(config.session.query(models.Poll.discord_message_id, models.Poll.id)
+                             .filter(models.Poll.discord_message_id.isnot(None))
+                             .filter(local_servers(models.Poll.discord_server_id)).all())
+
+
+def delete_poll_by_id(poll_id):
+    """
+    Delete a poll from the DB and the cache.
+
+    :param poll_id: the id of the poll in the DB.
+    """
+
+    notifications.cancel(poll_id)
+    cache.polls.invalidate(poll_id)
+
+    poll = config.session.query(models.Poll).get(poll_id)
+
+    if poll is not None:
+        cache.poll_messages.remove(poll.discord_message_id)
+        config.session.delete(poll)
+
+
+def delete_poll_by_message(poll_id, discord_message_id):
+    """
+    Delete a poll whose message no longer exists, unless the poll was moved to another message.
+
+    :param poll_id: the id of the poll in the DB.
+    :param discord_message_id: the id of the message that no longer exists.
+    """
+
+    # The message is being replaced, by a refresh that may not be committed yet
+    if cache.poll_messages.loaded and cache.poll_messages.get(discord_message_id) != poll_id:
+        return
+
+    poll = config.session.query(models.Poll).get(poll_id)
+
+    if poll is not None and poll.discord_message_id == discord_message_id:
+        delete_poll_by_id(poll_id)
+
+
+def create_message(poll, options, max_length=config.MESSAGE_MAX_LENGTH):
     """
     Creates a message given a poll.
 
     :param poll: the poll.
     :param options: the options available in the poll.
+    :param max_length: the maximum length of the message, or None for no limit.
     :return: the message that represents the poll.
     """
 
-    msg = '**%s** (poll_key: %s) (author: <@%s>)' % (poll.question, poll.poll_key, poll.discord_author_id)
+    # Only the number of votes is shown, which the options keep
+    if poll.only_numbers:
+        return rendering.render(poll, options, get_num_votes(options), max_length)
+
+    # Get all votes for all options
+    return rendering.render(poll, options, get_votes(options), max_length)
+
+
+def filter_participant(query, poll_participant):
+    """
+    Filter a query on votes by participant.
+
+    :param query: the query on models.Vote.
+    :param poll_participant: the id of the participant.
+    :return: the filtered query.
+    """
+
+    return query.filter(participant_condition(poll_participant))
+
+
+def participant_condition(poll_participant):
+    """
+    Create the condition that selects the votes of a participant.
+
+    :param poll_participant: the id of the participant.
+    :return: the condition.
+    """
+
+    # Check the type of participant
+    # int means discord user
+    # string means external participant
+    if type(poll_participant) == str:
+        return models.Vote.participant_name == poll_participant
+    else:
+        return models.Vote.discord_participant_id == poll_participant
+
+
+def get_cached_votes(options, poll_participant):
+    """
+    Get the options in which a participant voted, from the cache.
+
+    :param options: the options available in the poll.
+    :param poll_participant: the id of the participant.
+    :return: the set with the ids of the options or None, if the votes of the poll are not in the cache.
+    """
+
+    if len(options) == 0:
+        return set()
+
+    entry = cache.polls.get(options[0].poll_id)
+
+    if entry is not None and all(o.id in entry.voters for o in options):
+        return {o.id for o in options if poll_participant in entry.voters[o.id]}
+
+    return None
+
+
+def insert_votes(option_ids, poll_participant):
+    """
+    Insert the votes of a participant, ignoring those that already exist, and update the number of votes of the options.
+
+    :param option_ids: the ids of the options.
+    :param poll_participant: the id of the participant.
+    :return: the ids of the options that got a vote.
+    """
+
+    # Check the type of participant
+    # int means discord user
+    # string means external participant
+    if type(poll_participant) == str:
+        discord_participant_id = None
+        participant_name = poll_participant
+    else:
+        discord_participant_id = poll_participant
+        participant_name = None
 
-    if poll.closed:
-        msg += ' (Closed)'
+    votes = [{'option_id': option_id, 'discord_participant_id': discord_participant_id,
+              'participant_name': participant_name} for option_id in option_ids]
 
-    for i in range(len(options)):
-        msg += '\n%d - %s' % (options[i].position, options[i].option_text)
+    if config.engine.dialect.name == 'postgresql':
+        statement = postgresql.insert(models.Vote.__table__).values(votes).on_conflict_do_nothing() \
+            .returning(models.Vote.option_id)
 
-        # Get all votes for that option
-        votes = config.session.query(models.Vote).filter(models.Vote.option_id == options[i].id).all()
+        inserted_ids = [option_id for option_id, in config.session.execute(statement)]
+    # SQLite can not return the votes inserted, the existing ones are found first
+    else:
+        query = config.session.query(models.Vote.option_id).filter(models.Vote.option_id.in_(option_ids))
+        existing_ids = {option_id for option_id, in filter_participant(query, poll_participant).all()}
+
+        votes = [vote for vote in votes if vote['option_id'] not in existing_ids]
+        inserted_ids = [vote['option_id'] for vote in votes]
 
         if len(votes) > 0:
-            msg += ': %d votes' % len(votes)
+            config.session.execute(models.Vote.__table__.insert().prefix_with('OR IGNORE'), votes)
 
-            # Show the number of voters for the option
-            if poll.only_numbers:
-                msg += '.'
-            # Show the names of the voters for the option
-            else:
-                msg += ' ->'
+    update_num_votes(inserted_ids, 1)
 
-                for v in votes:
-                    if v.participant_name:
-                        msg += ' %s' % v.participant_name
-                    else:
-                        msg += ' <@%s>' % v.discord_participant_id
+    return inserted_ids
 
-        if options[i].locked:
-            msg += ' (locked)'
 
-    if not poll.closed:
-        if poll.new_options:
-            msg += '\n(New options allowed!)'
+def delete_votes(option_ids, poll_participant):
+    """
+    Delete the votes of a participant and update the number of votes of the options.
 
-        if poll.multiple_options:
-            msg += '\n(Multiple options allowed!)'
+    :param option_ids: the ids of the options.
+    :param poll_participant: the id of the participant.
+    :return: the ids of the options that lost a vote.
+    """
 
-        if poll.allow_external:
-            msg += '\n(External voters allowed!)'
+    # Make sure the votes that are still pending are deleted too
+    config.session.flush()
 
-    return msg
+    if config.engine.dialect.name == 'postgresql':
+        statement = models.Vote.__table__.delete() \
+            .where(models.Vote.option_id.in_(option_ids)) \
+            .where(participant_condition(poll_participant)) \
+            .returning(models.Vote.option_id)
+
+        deleted_ids = [option_id for option_id, in config.session.execute(statement)]
+    # SQLite can not return the votes deleted, they are found first
+    else:
+        query = config.session.query(models.Vote.option_id).filter(models.Vote.option_id.in_(option_ids))
+        deleted_ids = [option_id for option_id, in filter_participant(query, poll_participant).all()]
+
+        if len(deleted_ids) > 0:
+            query = config.session.query(models.Vote).filter(models.Vote.option_id.in_(deleted_ids))
+            filter_participant(query, poll_participant).delete(synchronize_session=False)
+
+    update_num_votes(deleted_ids, -1)
+
+    return deleted_ids
+
+
+def update_num_votes(option_ids, change):
+    """
+    Change the number of votes of options.
+
+    :param option_ids: the ids of the options.
+    :param change: the change to the number of votes of each option.
+    """
+
+    if len(option_ids) > 0:
+        config.session.query(models.Option).filter(models.Option.id.in_(option_ids)) \
+            .update({models.Option.num_votes: models.Option.num_votes + change}, synchronize_session=False)
+
+
+def repair_num_votes():
+    """
+    Fix the number of votes of the options that do not match their votes, such as after a failed update.
+
+    :return: the number of options fixed.
+    """
+
+    count = select([func.count(models.Vote.id)]).where(models.Vote.option_id == models.Option.id).as_scalar()
+    local_polls = config.session.query(models.Poll.id).filter(local_servers(models.Poll.discord_server_id))
+
+    return config.session.query(models.Option) \
+        .filter(models.Option.poll_id.in_(local_polls.subquery()), models.Option.num_votes != count) \
+        .update({models.Option.num_votes: count}, synchronize_session=False)
 
 
 def remove_prev_vote(options, poll_participant):
@@ -99,29 +471,32 @@ def remove_prev_vote(options, poll_participant):
     :param poll_participant: the id of the participant whose vote is to remove.
     """
 
-    ids = []
+    if len(options) == 0:
+        return
 
-    for o in options:
-        ids.append(o.id)
+    entry = cache.polls.get(options[0].poll_id)
 
-    # Get the previous vote
-    # int means discord used
-    # string means external participant
-    if type(poll_participant) == str:
-        prev_vote = config.session.query(models.Vote).filter(models.Vote.option_id.in_(ids)) \
-            .filter(models.Vote.participant_name == poll_participant).first()
+    # Use the cache to find the previous vote
+    if entry is not None and all(o.id in entry.voters for o in options):
+        ids = [o.id for o in options if poll_participant in entry.voters[o.id]]
+
+        # It had not voted yet
+        if len(ids) == 0:
+            return
     else:
-        prev_vote = config.session.query(models.Vote).filter(models.Vote.option_id.in_(ids)) \
-            .filter(models.Vote.discord_participant_id == poll_participant).first()
+        ids = [o.id for o in options]
 
     # If it had voted for something else remove it
-    if prev_vote is not None:
-        config.session.delete(prev_vote)
+    delete_votes(ids, poll_participant)
+
+    for option_id in ids:
+        cache.polls.remove_voter(options[0].poll_id, option_id, poll_participant)
 
 
 async def close_poll(db_poll, db_channel, selected_options):
     """
     Close a poll from the DB and update the message.
+    The poll must be removed from the cache after the commit.
 
     :param db_poll: the poll to close.
     :param db_channel: the corresponding channel entry in the DB.
@@ -129,36 +504,62 @@ async def close_poll(db_poll, db_channel, selected_options):
     """
 
     # Edit the message to display as closed
-    c = config.client.get_channel(db_channel.discord_id)
+    m = get_message(db_channel.discord_id, db_poll.discord_message_id)
 
     try:
-        m = await c.fetch_message(db_poll.discord_message_id)
+        options = await database.run(close_poll_options, db_poll, selected_options)
+        new_msg = await database.run(create_message, db_poll, options)
+
+        if config.VOTE_BUTTONS:
+            # Remove the buttons in the same request
+            await config.client.http.edit_message(db_channel.discord_id, db_poll.discord_message_id,
+                                                  content=new_msg, components=[])
+        else:
+            await m.edit(content=new_msg)
 
-        non_selected_options = config.session.query(models.Option).filter(models.Option.poll_id == db_poll.id) \
-            .filter(~models.Option.position.in_(selected_options)).all()
+            await m.clear_reactions()
 
-        # Delete all non selected options
-        for option in non_selected_options:
-            config.session.delete(option)
+        cache.renders.set_shown(db_poll.discord_message_id, new_msg)
 
-        config.session.flush()
+        # Send the complete results when they did not fit in the message
+        if config.CLOSED_POLL_RESULTS_FILE:
+            results = await database.run(create_message, db_poll, options, None)
 
-        # Update options list
-        options = config.session.query(models.Option).filter(models.Option.poll_id == db_poll.id) \
-            .order_by(models.Option.position).all()
+            if results != new_msg:
+                await config.client.get_channel(db_channel.discord_id).send(
+                    'Complete results of %s:' % db_poll.poll_key,
+                    file=discord.File(io.BytesIO(results.encode()), filename='%s.txt' % db_poll.poll_key))
+    except discord.errors.NotFound:
+        pass
 
-        db_poll.closed = True
-        db_poll.closed_date = datetime.date.today()
+    await database.run(config.session.flush)
 
-        new_msg = create_message(db_poll, options)
 
-        await m.edit(content=new_msg)
+def close_poll_options(db_poll, selected_options):
+    """
+    Keep only the selected options of a poll in the DB and mark it as closed.
 
-        await m.clear_reactions()
-    except discord.errors.NotFound:
-        pass
+    :param db_poll: the poll to close.
+    :param selected_options: the list of options that are to be displayed in the closed poll.
+    :return: the options that remain in the poll.
+    """
 
-    config.session.flush()
+    non_selected_options = config.session.query(models.Option.id).filter(models.Option.poll_id == db_poll.id) \
+        .filter(~models.Option.position.in_(selected_options)).subquery()
+
+    # Delete all non selected options, with their votes, in bulk instead of loading the votes of each option
+    config.session.query(models.Vote).filter(models.Vote.option_id.in_(non_selected_options)) \
+        .delete(synchronize_session=False)
+    config.session.query(models.Option).filter(models.Option.id.in_(non_selected_options)) \
+        .delete(synchronize_session=False)
+
+    # Update options list
+    options = get_options(db_poll.id)
+
+    db_poll.closed = True
+    db_poll.closed_date = datetime.date.today()
+
+    return options
 
 
 async def delete_poll(poll, db_channel, command_author):
@@ -172,57 +573,143 @@ async def delete_poll(poll, db_channel, command_author):
 
     # Only the author can delete the poll
     if command_author is None or poll.discord_author_id == command_author:
-        c = config.client.get_channel(db_channel.discord_id)
+        # Removed before deleting the message, so that its deletion event does not delete the poll too
+        cache.poll_messages.remove(poll.discord_message_id)
 
         try:
-            m = await c.fetch_message(poll.discord_message_id)
-
-            await m.delete()
+            await get_message(db_channel.discord_id, poll.discord_message_id).delete()
         except discord.errors.NotFound:
             pass
 
         # Delete the poll from the DB
-        config.session.delete(poll)
-        config.session.flush()
+        notifications.cancel(poll.id)
+        cache.polls.invalidate(poll.id)
+        await database.run(config.session.delete, poll)
+        await database.run(config.session.flush)
+
+
+def delete_channels(discord_channel_ids):
+    """
+    Delete channels, and their polls, from the DB and the caches.
+
+    :param discord_channel_ids: the ids of the Discord channels.
+    """
+
+    channels = config.session.query(models.Channel).filter(models.Channel.discord_id.in_(discord_channel_ids)).all()
+
+    for channel in channels:
+        for poll in channel.polls:
+            notifications.cancel(poll.id)
+            cache.polls.invalidate(poll.id)
+            cache.poll_messages.remove(poll.discord_message_id)
+
+        cache.channels.invalidate(channel.discord_id)
+        config.session.delete(channel)
+
+    config.session.commit()
+
+
+def delete_server_channels(discord_server_id):
+    """
+    Delete all channels of a server, and their polls, from the DB and the caches.
+
+    :param discord_server_id: the id of the Discord server.
+    """
+
+    channels = config.session.query(models.Channel.discord_id) \
+        .filter(models.Channel.discord_server_id == discord_server_id).all()
+
+    delete_channels([c.discord_id for c in channels])
 
 
 async def check_messages_exist():
     """
     Check all messages and channels to see if they still exist.
+    Deletions are handled as they happen, so this is only an audit for the ones that were missed.
 
     :return:
     """
 
-    channels = config.session.query(models.Channel).all()
+    channels = await database.run(config.session.query(models.Channel)
+                                  .filter(local_servers(models.Channel.discord_server_id)).all)
 
     # Delete all channels that no longer exist
     for channel in channels:
         c = config.client.get_channel(channel.discord_id)
 
         if c is None:
-            config.session.delete(channel)
+            cache.channels.invalidate(channel.discord_id)
+            await database.run(config.session.delete, channel)
 
-    config.session.flush()
+    await database.run(config.session.flush)
 
-    polls = config.session.query(models.Poll).all()
+    polls = await database.run(config.session.query(models.Poll)
+                               .filter(local_servers(models.Poll.discord_server_id)).all)
 
     # Delete all polls that no longer exist
     for poll in polls:
-        channel = config.session.query(models.Channel).filter(models.Channel.id == poll.channel_id).first()
+        channel = await database.run(
+            config.session.query(models.Channel).filter(models.Channel.id == poll.channel_id).first)
 
         c = config.client.get_channel(channel.discord_id)
 
         if poll.discord_message_id is None:
-            config.session.delete(poll)
+            await database.run(config.session.delete, poll)
         else:
             try:
                 await c.fetch_message(poll.discord_message_id)
             except discord.errors.NotFound:
-                config.session.delete(poll)
+                cache.polls.invalidate(poll.id)
+                cache.poll_messages.remove(poll.discord_message_id)
+                await database.run(config.session.delete, poll)
 
     print('Checking for deleted messages and channels...Done')
 
 
+def delete_polls_by_ids(poll_ids):
+    """
+    Delete polls, with their options and votes, from the DB and the caches, using bulk statements.
+
+    :param poll_ids: the ids of the polls in the DB.
+    """
+
+    polls = config.session.query(models.Poll.id, models.Poll.discord_message_id) \
+        .filter(models.Poll.id.in_(poll_ids)).all()
+
+    for poll in polls:
+        notifications.cancel(poll.id)
+        cache.polls.invalidate(poll.id)
+        cache.poll_messages.remove(poll.discord_message_id)
+
+    option_ids = config.session.query(models.Option.id).filter(models.Option.poll_id.in_(poll_ids)).subquery()
+
+    config.session.query(models.Vote).filter(models.Vote.option_id.in_(option_ids)) \
+        .delete(synchronize_session=False)
+    config.session.query(models.Option).filter(models.Option.poll_id.in_(poll_ids)) \
+        .delete(synchronize_session=False)
+    config.session.query(models.Poll).filter(models.Poll.id.in_(poll_ids)) \
+        .delete(synchronize_session=False)
+
+    config.session.commit()
+
+
+async def delete_message(channel_discord_id, discord_message_id):
+    """
+    Delete a message, if it still exists.
+
+    :param channel_discord_id: the id of the discord channel.
+    :param discord_message_id: the id of the message.
+    """
+
+    if config.client.get_channel(channel_discord_id) is None:
+        return
+
+    try:
+        await get_message(channel_discord_id, discord_message_id).delete()
+    except discord.errors.NotFound:
+        pass
+
+
 async def delete_old_closed_polls():
     """
     Delete old closed polls.
@@ -230,15 +717,24 @@ async def delete_old_closed_polls():
     :return:
     """
 
-    polls = config.session.query(models.Poll).filter(models.Poll.closed).all()
+    oldest_date = datetime.date.today() - datetime.timedelta(days=config.OLDEST_CLOSED_POLL_DAYS)
 
-    today = datetime.date.today()
+    # Get the polls closed before the oldest date allowed
+    polls = await database.run(config.session.query(models.Poll.id, models.Poll.discord_message_id,
+                                                    models.Channel.discord_id)
+                               .join(models.Channel, models.Channel.id == models.Poll.channel_id)
+                               .filter(models.Poll.closed, models.Poll.closed_date < oldest_date)
+                               .filter(local_servers(models.Poll.discord_server_id)).all)
 
-    # Delete all polls that no longer exist
-    for poll in polls:
-        if (today - poll.closed_date).days > config.OLDEST_CLOSED_POLL_DAYS:
-            channel = config.session.query(models.Channel).filter(models.Channel.id == poll.channel_id).first()
-            await delete_poll(poll, channel, None)
+    if len(polls) > 0:
+        await database.run(delete_polls_by_ids, [p.id for p in polls])
+
+        # Delete their messages in the background
+        for p in polls:
+            if p.discord_message_id is not None:
+                message_deletions.submit(delete_message, p.discord_id, p.discord_message_id)
+
+        await message_deletions.join()
 
     print('Checking for old closed polls...Done')
 
@@ -256,23 +752,6 @@ async def send_temp_message(message, channel, time=30):
     await channel.send(message, delete_after=time)
 
 
-async def show_interactive_message(message, channel, options: List[Any], time=300):
-    """
-    Show a temporary interactive message.
-
-    :param message: the message sent.
-    :param channel: the Discord channel.
-    :param options: the options list.
-    :param time: the time before deleting the temporary message, in seconds.
-    """
-
-    # Send the message
-    msg = await channel.send(message, delete_after=time)
-
-    # Add a reaction for each option
-    await add_options_reactions(msg, options)
-
-
 async def send_closed_poll_message(options, server, db_poll, channel):
     """
     Send a private message to every member that voted in the poll.
@@ -289,10 +768,10 @@ async def send_closed_poll_message(options, server, db_poll, channel):
         ids.append(o.id)
 
     # Get all the votes with different participants from this poll
-    votes = config.session.query(models.Vote).filter(models.Vote.option_id.in_(ids)) \
-        .distinct(models.Vote.discord_participant_id, models.Vote.participant_name).all()
+    votes = await database.run(config.session.query(models.Vote).filter(models.Vote.option_id.in_(ids))
+                               .distinct(models.Vote.discord_participant_id, models.Vote.participant_name).all)
 
-    # Send a private message to each member that voted
+    # Send a private message to each member that voted, in the background
     for v in votes:
         # If it's not an external user
         if v.discord_participant_id is not None:
@@ -302,106 +781,90 @@ async def send_closed_poll_message(options, server, db_poll, channel):
             if m is not None:
                 # Don't send message to the author
                 if v.discord_participant_id != db_poll.discord_author_id:
-                    try:
-                        await m.send('models.Poll %s was closed, check the results in %s!'
-                                     % (db_poll.poll_key, channel.mention))
-                    except discord.errors.Forbidden:
-                        pass
+                    notifications.notify(db_poll.id, m, 'models.Poll %s was closed, check the results in %s!'
+                                         % (db_poll.poll_key, channel.mention))
 
 
-def add_vote(option, poll_participant, db_options, multiple_options):
+def apply_votes(selected_options, poll_participant, db_options, multiple_options, unvote=False):
     """
-    Add a vote.
+    Add or remove the votes of a participant in a list of options, all at once.
 
-    :param option: the voted option.
-    :param poll_participant: the id of the participant whose vote is to add.
+    :param selected_options: the numbers of the options.
+    :param poll_participant: the id of the participant.
     :param db_options: the existing options in the db.
     :param multiple_options: if multiple options are allowed in this poll.
+    :param unvote: whether the votes are to remove instead of add.
+    :return: True if any vote was added or removed.
     """
 
-    new_vote = False
+    # Only valid options that are not locked
+    selected_ids = [db_options[o - 1].id for o in selected_options
+                    if 0 < o <= len(db_options) and not db_options[o - 1].locked]
 
-    # If it is a valid option
-    if 0 < option <= len(db_options):
-        if db_options[option - 1].locked:
-            return False
+    if len(selected_ids) == 0:
+        return False
 
-        # Check the type of participant
-        # int means discord used
-        # string means external participant
-        if type(poll_participant) == str:
-            discord_participant_id = None
-            participant_name = poll_participant
+    if unvote:
+        add_ids = []
+        remove_ids = list(dict.fromkeys(selected_ids))
+    elif multiple_options:
+        add_ids = list(dict.fromkeys(selected_ids))
+        remove_ids = []
+    # If multiple options are not allowed only the last option counts, replacing the previous vote
+    else:
+        add_ids = [selected_ids[-1]]
+        remove_ids = [o.id for o in db_options if o.id != selected_ids[-1]]
 
-            vote = config.session.query(models.Vote) \
-                .filter(models.Vote.option_id == db_options[option - 1].id) \
-                .filter(models.Vote.participant_name == participant_name).first()
-        else:
-            discord_participant_id = poll_participant
-            participant_name = None
+    # Skip what the cache knows is already done, the DB ignores it otherwise
+    voted_ids = get_cached_votes(db_options, poll_participant)
 
-            vote = config.session.query(models.Vote) \
-                .filter(models.Vote.option_id == db_options[option - 1].id) \
-                .filter(models.Vote.discord_participant_id == discord_participant_id).first()
+    if voted_ids is not None:
+        add_ids = [option_id for option_id in add_ids if option_id not in voted_ids]
+        remove_ids = [option_id for option_id in remove_ids if option_id in voted_ids]
 
-        # Vote for an option if multiple options are allowed and he is yet to vote this option
-        if multiple_options and vote is None:
-            # Add the new vote
-            vote = models.Vote(db_options[option - 1].id, discord_participant_id, participant_name)
-            config.session.add(vote)
+    poll_id = db_options[0].poll_id
+    poll_edited = False
 
-            new_vote = True
+    if len(remove_ids) > 0:
+        poll_edited |= len(delete_votes(remove_ids, poll_participant)) > 0
 
-        # If multiple options are not allowed
-        elif not multiple_options:
-            # The participant didn't vote this option
-            if vote is None:
-                remove_prev_vote(db_options, poll_participant)
+        for option_id in remove_ids:
+            cache.polls.remove_voter(poll_id, option_id, poll_participant)
 
-                # Add the new vote
-                vote = models.Vote(db_options[option - 1].id, discord_participant_id, participant_name)
-                config.session.add(vote)
+    if len(add_ids) > 0:
+        poll_edited |= len(insert_votes(add_ids, poll_participant)) > 0
 
-                new_vote = True
+        for option_id in add_ids:
+            cache.polls.add_voter(poll_id, option_id, poll_participant)
 
-    return new_vote
+    return poll_edited
 
 
-def remove_vote(option, poll_participant, db_options):
+def add_vote(option, poll_participant, db_options, multiple_options):
     """
-    Remove a vote.
+    Add a vote.
 
-    :param option: the option to remove.
-    :param poll_participant: the discord id of the participant whose vote is to remove.
+    :param option: the voted option.
+    :param poll_participant: the id of the participant whose vote is to add.
     :param db_options: the existing options in the db.
+    :param multiple_options: if multiple options are allowed in this poll.
+    :return: True if the vote was added.
     """
 
-    vote_removed = False
+    return apply_votes([option], poll_participant, db_options, multiple_options)
 
-    # If it is a valid option
-    if 0 < option <= len(db_options):
-        if db_options[option - 1].locked:
-            return False
 
-        # Check the type of participant
-        # int means discord user
-        # string means external participant
-        if type(poll_participant) == str:
-            vote = config.session.query(models.Vote) \
-                .filter(models.Vote.option_id == db_options[option - 1].id) \
-                .filter(models.Vote.participant_name == poll_participant).first()
-        else:
-            vote = config.session.query(models.Vote) \
-                .filter(models.Vote.option_id == db_options[option - 1].id) \
-                .filter(models.Vote.discord_participant_id == poll_participant).first()
-
-        if vote is not None:
-            # Remove the vote from this option
-            config.session.delete(vote)
+def remove_vote(option, poll_participant, db_options):
+    """
+    Remove a vote.
 
-            vote_removed = True
+    :param option: the option to remove.
+    :param poll_participant: the discord id of the participant whose vote is to remove.
+    :param db_options: the existing options in the db.
+    :return: True if the vote was removed.
+    """
 
-    return vote_removed
+    return apply_votes([option], poll_participant, db_options, True, unvote=True)
 
 
 def date_given_day(date, day):
@@ -441,52 +904,38 @@ async def refresh_poll(poll, channel_discord_id):
 
     c = config.client.get_channel(channel_discord_id)
 
+    # The message of the poll is going to change
+    cache.poll_messages.remove(poll.discord_message_id)
+
     # Delete this message
     try:
-        m = await c.fetch_message(poll.discord_message_id)
-
-        await m.delete()
+        await get_message(channel_discord_id, poll.discord_message_id).delete()
     except discord.errors.NotFound:
         pass
 
-    options = config.session.query(models.Option).filter(models.Option.poll_id == poll.id) \
-        .order_by(models.Option.position).all()
+    options = await database.run(get_options, poll.id)
 
     # TODO: START - TEMPORARY FIX FOR ANDROID DEVICES - WHEN FIXED, REVERT THIS
     # ------- START -------
-    msg = await c.send('Placeholder')
+    msg = await send_poll_message(c, 'Placeholder', [] if poll.closed else options)
     poll.discord_message_id = msg.id
+    cache.poll_messages.add(msg.id, poll.id)
 
-    config.session.commit()
-
-    await msg.edit(content=create_message(poll, options))
-    # ------- END -------
-
-    print('Poll %s refreshed!' % poll.poll_key)
-
-    if not poll.closed:
-        # Add a reaction for each option, with 9 being the max number of reactions
-        emoji = u'\u0031'
-
-        for i in range(min(len(options), 9)):
-            await msg.add_reaction(emoji + u'\u20E3')
-            emoji = chr(ord(emoji) + 1)
-
-
-async def refresh_all_polls():
-    """Refresh all polls, making sure reactions still work when the application is restarted."""
+    await database.run(config.session.commit)
 
-    polls = config.session.query(models.Poll).all()
+    # Only after the commit, so that other events do not cache it again with the previous message
+    cache.polls.invalidate(poll.id)
 
-    for p in polls:
-        db_channel = config.session.query(models.Channel).filter(models.Channel.id == p.channel_id).first()
+    content = await database.run(create_message, poll, options)
 
-        if db_channel is not None:
-            await refresh_poll(p, db_channel.discord_id)
+    await msg.edit(content=content)
+    cache.renders.set_shown(msg.id, content)
+    # ------- END -------
 
-    config.session.flush()
+    # Only once the poll can be found by the other events, so that the votes of the first reactions are not ignored
+    await add_vote_reactions(msg, [] if poll.closed else options)
 
-    print('Refreshing all polls...Done')
+    print('Poll %s refreshed!' % poll.poll_key)
 
 
 async def remove_reaction(discord_poll_msg, emoji):
@@ -553,9 +1002,99 @@ def create_channel(command: discord.message.Message) -> models.Channel:
     config.session.add(db_channel)
     config.session.commit()
 
+    cache.channels.invalidate(discord_channel_id)
+
     return db_channel
 
 
+async def send_poll_message(channel, content, options: List[Any]):
+    """
+    Send the message of a poll, with a button to vote for each of the options.
+    Without buttons, the reactions to vote are added with add_vote_reactions.
+
+    :param channel: the Discord channel.
+    :param content: the content of the message.
+    :param options: the options list.
+    :return: the message.
+    """
+
+    if not config.VOTE_BUTTONS:
+        msg = await channel.send(content)
+        cache.renders.set_shown(msg.id, content)
+
+        return msg
+
+    # The buttons are sent with the message, which discord.py does not support
+    route = discord.http.Route('POST', '/channels/{channel_id}/messages', channel_id=channel.id)
+    data = await config.client.http.request(route, json={'content': content,
+                                                         'components': create_vote_buttons(options)})
+
+    cache.renders.set_shown(int(data['id']), content)
+
+    return channel.get_partial_message(int(data['id']))
+
+
+def create_vote_buttons(options: List[Any]):
+    """
+    Create a button for each of the options in the list.
+    Maximum number of buttons is 25, in 5 rows.
+
+    :param options: the options list.
+    :return: the components of the message, in the format of the Discord API.
+    """
+
+    buttons = [{'type': 2, 'style': 2, 'label': str(i + 1), 'custom_id': 'vote:%d' % (i + 1)}
+               for i in range(min(len(options), 25))]
+
+    return [{'type': 1, 'components': buttons[i:i + 5]} for i in range(0, len(buttons), 5)]
+
+
+async def edit_vote_buttons(channel_discord_id, discord_message_id, options: List[Any], content=None):
+    """
+    Replace the buttons of the message of a poll with a button for each of the options.
+
+    :param channel_discord_id: the id of the discord channel.
+    :param discord_message_id: the id of the message of the poll.
+    :param options: the options list.
+    :param content: the new content of the message, edited in the same request, or None to keep it.
+    """
+
+    fields = {'components': create_vote_buttons(options)}
+
+    if content is not None:
+        fields['content'] = content
+
+    await config.client.http.edit_message(channel_discord_id, discord_message_id, **fields)
+
+    if content is not None:
+        cache.renders.set_shown(discord_message_id, content)
+
+
+async def acknowledge_interaction(interaction):
+    """
+    Acknowledge an interaction without changing the message, which is edited afterwards.
+
+    :param interaction: the interaction, in the format of the Discord API.
+    """
+
+    route = discord.http.Route('POST', '/interactions/{interaction_id}/{interaction_token}/callback',
+                               interaction_id=interaction['id'], interaction_token=interaction['token'])
+
+    await config.client.http.request(route, json={'type': 6})
+
+
+async def add_vote_reactions(message: discord.message.Message, options: List[Any]):
+    """
+    Add the reactions to vote for each of the options to the message of a poll, unless it has buttons.
+
+    :param message: the message of the poll.
+    :param options: the options list.
+    """
+
+    if not config.VOTE_BUTTONS:
+        await add_options_reactions(message, options)
+
+
 async def add_options_reactions(message: discord.message.Message, options: List[Any]):
     """
     Add a reaction for each of the options in the list.
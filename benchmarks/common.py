@@ -0,0 +1,120 @@
+"""
+Shared setup for the benchmarks.
+
+The benchmarks run against the database in DATABASE_URL, which should be a scratch database as it is filled with fake
+polls. When it is not defined, a temporary SQLite database is used.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_database():
+    """
+    Prepare a database with an up to date schema and load the configuration of the bot for it.
+
+    :return: the configuration module.
+    """
+
+    sys.path.insert(0, ROOT_DIR)
+
+    # The migrations directory is relative to the root of the repository
+    os.chdir(ROOT_DIR)
+
+    if 'DATABASE_URL' not in os.environ:
+        os.environ['DATABASE_URL'] = 'sqlite:///%s' % os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+
+    os.environ.setdefault('BOT_TOKEN', 'benchmark')
+
+    # An empty database gets its tables created when the configuration is loaded
+    import configuration
+
+    return configuration
+
+
+def create_fake_poll(session, poll_key, num_options, num_voters, multiple_options=False, only_numbers=False):
+    """
+    Create a poll in the DB with votes from fake participants.
+
+    :param session: the DB session.
+    :param poll_key: the key of the poll.
+    :param num_options: the number of options in the poll.
+    :param num_voters: the number of participants voting in the poll.
+    :param multiple_options: if multiple options are allowed in this poll.
+    :param only_numbers: if the poll only shows the number of votes.
+    :return: the poll and its options.
+    """
+
+    import models
+
+    channel = session.query(models.Channel).filter(models.Channel.discord_id == 1).first()
+
+    if channel is None:
+        channel = models.Channel(1, 1)
+        session.add(channel)
+        session.flush()
+
+    poll = models.Poll(poll_key, 1, 'Question %s?' % poll_key, multiple_options, only_numbers, False, False,
+                       channel.id, 1)
+    poll.discord_message_id = abs(hash(poll_key)) % 10 ** 15
+    session.add(poll)
+    session.flush()
+
+    options = [models.Option(poll.id, i + 1, 'Option %d' % (i + 1)) for i in range(num_options)]
+    session.add_all(options)
+    session.flush()
+
+    votes = []
+
+    for participant in range(num_voters):
+        votes.append({'option_id': options[participant % num_options].id,
+                      'discord_participant_id': 10 ** 17 + participant,
+                      'participant_name': None})
+
+        # Half of the participants also vote in the next option
+        if multiple_options and participant % 2 == 0:
+            votes.append({'option_id': options[(participant + 1) % num_options].id,
+                          'discord_participant_id': 10 ** 17 + participant,
+                          'participant_name': None})
+
+    for option in options:
+        option.num_votes = sum(1 for vote in votes if vote['option_id'] == option.id)
+
+    session.bulk_insert_mappings(models.Vote, votes)
+    session.commit()
+
+    return poll, options
+
+
+def percentile(values, p):
+    """
+    Get a percentile of a list of values.
+
+    :param values: the values.
+    :param p: the percentile, between 0 and 100.
+    :return: the value at that percentile.
+    """
+
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def timed(func, *args, **kwargs):
+    """
+    Time a call to a function.
+
+    :return: the time taken, in seconds, and the result of the function.
+    """
+
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+
+    return time.perf_counter() - start, result
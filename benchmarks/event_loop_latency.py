@@ -0,0 +1,109 @@
+"""
+Event loop latency while handling concurrent reactions.
+
+Runs the DB work of on_reaction_add for many concurrent reactions, once directly in the coroutines (as the bot used to
+do) and once through the database executor, while measuring how late the event loop wakes up a periodic timer.
+A delay is added to each statement to simulate the round trip to a remote Postgres.
+
+Usage: python3 benchmarks/event_loop_latency.py [num_reactions] [round_trip_ms]
+"""
+
+import asyncio
+import sys
+import time
+
+from common import create_fake_poll, percentile, setup_database
+
+config = setup_database()
+
+import auxiliary
+import database
+import models
+
+from sqlalchemy import event
+
+# Interval of the timer that measures the latency of the event loop
+TICK_SEC = 0.005
+
+
+def simulate_round_trip(round_trip_sec):
+    """Add a delay to every statement sent to the DB."""
+
+    @event.listens_for(config.engine, 'before_cursor_execute')
+    def before_cursor_execute(*args):
+        time.sleep(round_trip_sec)
+
+
+async def measure_lag(lags, stop):
+    """Record how late the event loop runs a timer, until stop is set."""
+
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK_SEC)
+        lags.append(time.perf_counter() - start - TICK_SEC)
+
+
+async def reaction_blocking(poll, participant):
+    """The DB work of a reaction, done in the event loop."""
+
+    db_poll = config.session.query(models.Poll).filter(models.Poll.discord_message_id == poll.discord_message_id) \
+        .first()
+    db_options = auxiliary.get_options(db_poll.id)
+
+    if auxiliary.add_vote(1, participant, db_options, db_poll.multiple_options):
+        auxiliary.create_message(db_poll, db_options)
+        config.session.commit()
+
+
+@database.unit_of_work
+async def reaction_executor(poll, participant):
+    """The DB work of a reaction, done in the database executor with a session of its own."""
+
+    db_poll = await database.run(
+        config.session.query(models.Poll).filter(models.Poll.discord_message_id == poll.discord_message_id).first)
+    db_options = await database.run(auxiliary.get_options, db_poll.id)
+
+    if await database.run(auxiliary.add_vote, 1, participant, db_options, db_poll.multiple_options):
+        await database.run(auxiliary.create_message, db_poll, db_options)
+        await database.run(config.session.commit)
+
+
+async def run_scenario(handler, poll, num_reactions, first_participant):
+    """Run concurrent reactions with a handler, returning the event loop lags and the total time."""
+
+    lags = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(measure_lag(lags, stop))
+
+    # Let the monitor start
+    await asyncio.sleep(TICK_SEC)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[handler(poll, first_participant + i) for i in range(num_reactions)])
+    total = time.perf_counter() - start
+
+    stop.set()
+    await monitor
+
+    return lags, total
+
+
+async def main():
+    num_reactions = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    round_trip_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+
+    poll, _ = create_fake_poll(config.session, 'latency%d' % time.time(), 9, 200, multiple_options=True)
+    simulate_round_trip(round_trip_ms / 1000)
+
+    print('%d concurrent reactions, %.1f ms per statement' % (num_reactions, round_trip_ms))
+    print('%-10s %12s %12s %12s %12s' % ('mode', 'lag p50 ms', 'lag p99 ms', 'lag max ms', 'total s'))
+
+    for name, handler, first_participant in (('blocking', reaction_blocking, 1),
+                                             ('executor', reaction_executor, 10 ** 6)):
+        lags, total = await run_scenario(handler, poll, num_reactions, first_participant)
+
+        print('%-10s %12.2f %12.2f %12.2f %12.2f' % (name, percentile(lags, 50) * 1000, percentile(lags, 99) * 1000,
+                                                    max(lags, default=0) * 1000, total))
+
+
+asyncio.run(main())
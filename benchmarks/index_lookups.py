@@ -0,0 +1,138 @@
+"""
+Latency of the most frequent lookups, with and without the indexes.
+
+Fills the DB with polls and a few hundred thousand votes, then times each lookup with the indexes of the models and
+after dropping them. The unique constraints of the votes are not dropped, so the lookups of votes are always indexed.
+
+Usage: python3 benchmarks/index_lookups.py [num_polls] [votes_per_option]
+"""
+
+import random
+import sys
+import time
+
+from common import percentile, setup_database
+
+config = setup_database()
+
+import models
+
+from sqlalchemy import func
+
+OPTIONS_PER_POLL = 5
+SERVERS = 200
+REPETITIONS = 200
+
+# Id of the first fake poll, to avoid the ones in the DB
+FIRST_ID = 10 ** 6
+
+
+def fill(num_polls, votes_per_option):
+    """Insert the fake channels, polls, options and votes."""
+
+    channels = [{'id': FIRST_ID + s, 'discord_id': FIRST_ID + s, 'discord_server_id': FIRST_ID + s,
+                 'delete_commands': False, 'delete_all': False} for s in range(SERVERS)]
+    config.session.bulk_insert_mappings(models.Channel, channels)
+
+    polls = []
+    options = []
+    votes = []
+
+    for p in range(num_polls):
+        server = p % SERVERS
+
+        polls.append({'id': FIRST_ID + p, 'poll_key': 'lookup%d' % p, 'question': 'Question?',
+                      'channel_id': FIRST_ID + server, 'discord_server_id': FIRST_ID + server,
+                      'discord_author_id': p % 1000, 'discord_message_id': FIRST_ID + p, 'closed': False})
+
+        for o in range(OPTIONS_PER_POLL):
+            option_id = (FIRST_ID + p) * OPTIONS_PER_POLL + o
+            options.append({'id': option_id, 'poll_id': FIRST_ID + p, 'position': o + 1,
+                            'option_text': 'Option', 'locked': False, 'num_votes': votes_per_option})
+
+            for v in range(votes_per_option):
+                votes.append({'option_id': option_id, 'discord_participant_id': v, 'participant_name': None})
+
+    config.session.bulk_insert_mappings(models.Poll, polls)
+    config.session.bulk_insert_mappings(models.Option, options)
+    config.session.bulk_insert_mappings(models.Vote, votes)
+    config.session.commit()
+
+    return len(votes)
+
+
+def lookups(num_polls, votes_per_option):
+    """The lookups done by the bot, each receiving a random poll number."""
+
+    def option_id(p):
+        return (FIRST_ID + p) * OPTIONS_PER_POLL + p % OPTIONS_PER_POLL
+
+    return {
+        'vote by participant': lambda p: config.session.query(models.Vote)
+            .filter(models.Vote.option_id == option_id(p))
+            .filter(models.Vote.discord_participant_id == p % votes_per_option).first(),
+        'vote by name': lambda p: config.session.query(models.Vote)
+            .filter(models.Vote.option_id == option_id(p))
+            .filter(models.Vote.participant_name == 'External').first(),
+        'options of poll': lambda p: config.session.query(models.Option)
+            .filter(models.Option.poll_id == FIRST_ID + p).order_by(models.Option.position).all(),
+        'poll by key': lambda p: config.session.query(models.Poll)
+            .filter(models.Poll.poll_key == 'lookup%d' % p).first(),
+        'polls in server': lambda p: config.session.query(func.count(models.Poll.id))
+            .filter(models.Poll.discord_server_id == FIRST_ID + p % SERVERS).scalar(),
+        'polls of author': lambda p: config.session.query(models.Poll)
+            .filter(models.Poll.discord_server_id == FIRST_ID + p % SERVERS)
+            .filter(models.Poll.discord_author_id == p % 1000).all(),
+        'polls in channel': lambda p: config.session.query(models.Poll)
+            .filter(models.Poll.channel_id == FIRST_ID + p % SERVERS).all(),
+    }
+
+
+def measure(queries, num_polls):
+    """Time each lookup, returning the p50 and p99 in milliseconds."""
+
+    results = {}
+
+    for name, query in queries.items():
+        times = []
+
+        for _ in range(REPETITIONS):
+            p = random.randrange(num_polls)
+
+            start = time.perf_counter()
+            query(p)
+            times.append((time.perf_counter() - start) * 1000)
+
+        results[name] = (percentile(times, 50), percentile(times, 99))
+
+    return results
+
+
+def main():
+    num_polls = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    votes_per_option = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+    print('Inserted %d votes' % fill(num_polls, votes_per_option))
+
+    queries = lookups(num_polls, votes_per_option)
+    with_indexes = measure(queries, num_polls)
+
+    indexes = [i for table in models.base.metadata.sorted_tables for i in table.indexes]
+
+    for index in indexes:
+        index.drop(config.engine)
+
+    without_indexes = measure(queries, num_polls)
+
+    for index in indexes:
+        index.create(config.engine)
+
+    print('%-20s %18s %18s %18s %18s' % ('lookup', 'no index p50 ms', 'no index p99 ms', 'index p50 ms',
+                                         'index p99 ms'))
+
+    for name in queries:
+        print('%-20s %18.3f %18.3f %18.3f %18.3f' % (name, without_indexes[name][0], without_indexes[name][1],
+                                                     with_indexes[name][0], with_indexes[name][1]))
+
+
+main()
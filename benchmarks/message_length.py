@@ -0,0 +1,44 @@
+"""
+Length of the message of polls with more voters than fit in a message.
+
+Renders polls where the voters of some options are left out, with the options of many and of few voters in different
+orders, failing when the message is not close to the limit, as the space left is enough for more voters.
+
+Usage: python3 benchmarks/message_length.py
+"""
+
+import sys
+import types
+
+from common import setup_database
+
+config = setup_database()
+
+import rendering
+
+# The message can be shorter than the limit by less than this fraction, as the names do not fill the space exactly
+MAX_UNUSED = 0.05
+
+# Number of voters in each option of each poll
+CASES = [(500, 2), (2, 500), (200, 200), (3, 1000, 3, 3), (5000, 1, 1, 1, 1, 1, 1, 1, 1), (40, 300, 10, 2000)]
+
+failed = False
+
+for c, voters in enumerate(CASES):
+    poll = types.SimpleNamespace(question='Question %d?' % c, poll_key='length%d' % c, discord_author_id=1,
+                                 closed=False, new_options=False, multiple_options=False, allow_external=False,
+                                 only_numbers=False)
+    options = [types.SimpleNamespace(id=i + 1, position=i + 1, option_text='Option %d' % (i + 1), locked=False)
+               for i in range(len(voters))]
+    votes = {o.id: [10 ** 17 + 10 ** 5 * o.id + v for v in range(n)] for o, n in zip(options, voters)}
+
+    length = len(rendering.render(poll, options, votes, config.MESSAGE_MAX_LENGTH))
+
+    print('%-40s %5d of %d characters' % (voters, length, config.MESSAGE_MAX_LENGTH))
+
+    if length < config.MESSAGE_MAX_LENGTH * (1 - MAX_UNUSED):
+        failed = True
+
+if failed:
+    print('The voters left out would fit in the space left in the message!')
+    sys.exit(1)
@@ -0,0 +1,212 @@
+"""
+Duration of the hot functions of auxiliary, on fake polls.
+
+Times create_message for polls with 2, 9 and 50 options and 10 to 10000 voters, add_vote and remove_vote in single and
+multiple choice polls, parse_command_parameters on long commands and create_weekly_options. The results are written as
+JSON and compared against a baseline, failing when a function is slower than the baseline by more than the tolerance.
+The baseline depends on the machine and the DB, save a new one with --save before changing the code.
+
+Usage: python3 benchmarks/micro.py [--repeat N] [--output results.json] [--baseline benchmarks/baseline.json]
+                                   [--tolerance 1.0] [--save]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+
+from common import ROOT_DIR, create_fake_poll, percentile, setup_database
+
+config = setup_database()
+
+import auxiliary
+
+DEFAULT_BASELINE = os.path.join(ROOT_DIR, 'benchmarks', 'baseline.json')
+
+# Id of the first fake participant voting, after the ones created with the polls
+FIRST_PARTICIPANT = 10 ** 18
+
+
+def bench_create_message(num_options, num_voters):
+    """Render the message of a poll, reading its votes from the DB."""
+
+    poll, options = create_fake_poll(config.session, 'micro%d_%d' % (num_options, num_voters), num_options,
+                                     num_voters)
+
+    return lambda: auxiliary.create_message(poll, options)
+
+
+def bench_votes(multiple_options):
+    """Add and remove the vote of a new participant, committing each change as the handlers do."""
+
+    poll, options = create_fake_poll(config.session, 'microvote%d' % multiple_options, 9, 1000, multiple_options)
+    participants = iter(range(FIRST_PARTICIPANT, FIRST_PARTICIPANT + 10 ** 6))
+
+    def add():
+        participant = next(participants)
+        auxiliary.add_vote(participant % 9 + 1, participant, options, multiple_options)
+        config.session.commit()
+
+        return participant
+
+    def remove(participant):
+        auxiliary.remove_vote(participant % 9 + 1, participant, options)
+        config.session.commit()
+
+    return add, remove
+
+
+def run(func, repeat, number=1):
+    """
+    Time a function.
+
+    :param func: the function, called without arguments.
+    :param repeat: the number of samples.
+    :param number: the number of calls in each sample.
+    :return: the median and the 99th percentile of the duration of a call, in milliseconds.
+    """
+
+    durations = []
+
+    # Warm up the caches of the DB and of the statements
+    func()
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+
+        for _ in range(number):
+            func()
+
+        durations.append((time.perf_counter() - start) * 1000 / number)
+
+    return {'median_ms': percentile(durations, 50), 'p99_ms': percentile(durations, 99)}
+
+
+def run_votes(multiple_options, repeat):
+    """Time add_vote and remove_vote, each removing the vote added before it."""
+
+    add, remove = bench_votes(multiple_options)
+    add_durations = []
+    remove_durations = []
+
+    for _ in range(repeat + 1):
+        start = time.perf_counter()
+        participant = add()
+        add_durations.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        remove(participant)
+        remove_durations.append((time.perf_counter() - start) * 1000)
+
+    # The first one is the warm up
+    return [{'median_ms': percentile(durations[1:], 50), 'p99_ms': percentile(durations[1:], 99)}
+            for durations in (add_durations, remove_durations)]
+
+
+def run_all(repeat):
+    """Run all the benchmarks, returning the results by name."""
+
+    results = {}
+
+    for num_options in (2, 9, 50):
+        for num_voters in (10, 100, 1000, 10000):
+            name = 'create_message[options=%d,voters=%d]' % (num_options, num_voters)
+            results[name] = run(bench_create_message(num_options, num_voters), repeat)
+
+    for multiple_options in (False, True):
+        kind = 'multiple' if multiple_options else 'single'
+        add, remove = run_votes(multiple_options, repeat)
+
+        results['add_vote[%s]' % kind] = add
+        results['remove_vote[%s]' % kind] = remove
+
+    for num_options in (10, 100):
+        command = '!poll -m -k=key "%s?" %s' % (' '.join(['word'] * 50),
+                                                 ' '.join('"Option number %d"' % i for i in range(num_options)))
+        results['parse_command_parameters[options=%d]' % num_options] = \
+            run(lambda: auxiliary.parse_command_parameters(command), repeat, 1000)
+
+    start_date = datetime.date(2021, 1, 4)
+
+    for num_days in (7, 31):
+        end_date = start_date + datetime.timedelta(days=num_days - 1)
+        results['create_weekly_options[days=%d]' % num_days] = \
+            run(lambda: auxiliary.create_weekly_options(start_date, end_date), repeat, 1000)
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the results against the baseline.
+
+    :return: the names of the benchmarks slower than the baseline by more than the tolerance.
+    """
+
+    regressions = []
+
+    for name, result in results.items():
+        if name not in baseline:
+            print('%-45s %10.4f ms (no baseline)' % (name, result['median_ms']))
+            continue
+
+        ratio = result['median_ms'] / max(baseline[name]['median_ms'], 1e-6)
+        regressed = ratio > 1 + tolerance
+
+        print('%-45s %10.4f ms (baseline %10.4f ms, %+.0f%%)%s'
+              % (name, result['median_ms'], baseline[name]['median_ms'], (ratio - 1) * 100,
+                 ' REGRESSION' if regressed else ''))
+
+        if regressed:
+            regressions.append(name)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Duration of the hot functions of auxiliary.')
+    parser.add_argument('--repeat', type=int, default=20, help='number of samples of each benchmark')
+    parser.add_argument('--output', help='file where the results are written as JSON')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='file with the results to compare against')
+    parser.add_argument('--tolerance', type=float, default=1.0,
+                        help='fraction by which a benchmark can be slower than the baseline')
+    parser.add_argument('--save', action='store_true', help='save the results as the new baseline')
+    args = parser.parse_args()
+
+    output = {'python': platform.python_version(), 'database': config.engine.url.get_backend_name(),
+              'repeat': args.repeat, 'results': run_all(args.repeat)}
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+
+        print('Saved the baseline in %s.' % args.baseline)
+        return
+
+    baseline = {}
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+
+        if stored['database'] != output['database']:
+            print('The baseline was taken on %s, not %s!' % (stored['database'], output['database']))
+        else:
+            baseline = stored['results']
+
+    regressions = compare(output['results'], baseline, args.tolerance)
+
+    if len(regressions) > 0:
+        print('%d benchmarks are slower than the baseline!' % len(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+API calls and time needed to send the message of a new poll.
+
+Sends the messages of polls through send_poll_message, once voting with reactions and once voting with buttons,
+against a fake Discord that adds a delay to each request and limits the reactions of a channel to one every 250 ms, as
+Discord does.
+
+Usage: python3 benchmarks/poll_creation.py [num_polls] [round_trip_ms]
+"""
+
+import asyncio
+import itertools
+import sys
+import time
+
+from common import setup_database
+
+config = setup_database()
+
+import auxiliary
+
+# Time between reactions added to messages of the same channel
+REACTION_INTERVAL_SEC = 0.25
+
+message_ids = itertools.count(1)
+
+
+class FakeHTTP:
+    """Requests to a fake Discord, counting them."""
+
+    def __init__(self, round_trip_sec):
+        self.round_trip_sec = round_trip_sec
+        self.calls = 0
+
+    async def request(self, route, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.round_trip_sec)
+
+        return {'id': str(next(message_ids))}
+
+
+class FakeMessage:
+    def __init__(self, message_id, channel):
+        self.id = message_id
+        self.channel = channel
+
+    async def add_reaction(self, emoji):
+        # Wait for the rate limit of the reactions in the channel
+        wait = self.channel.next_reaction - time.perf_counter()
+
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        self.channel.next_reaction = time.perf_counter() + REACTION_INTERVAL_SEC
+
+        await config.client.http.request(None)
+
+
+class FakeChannel:
+    def __init__(self):
+        self.id = 1
+        self.next_reaction = 0
+
+    async def send(self, content):
+        data = await config.client.http.request(None)
+
+        return FakeMessage(int(data['id']), self)
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(message_id, self)
+
+
+async def main():
+    num_polls = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    round_trip_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 50.0
+
+    config.client.http = FakeHTTP(round_trip_ms / 1000)
+
+    print('%d polls, %.1f ms per request' % (num_polls, round_trip_ms))
+    print('%-10s %8s %14s %14s' % ('mode', 'options', 'calls / poll', 'ms / poll'))
+
+    for num_options in (2, 5, 9):
+        options = ['Option %d' % (i + 1) for i in range(num_options)]
+
+        for name, buttons in (('reactions', False), ('buttons', True)):
+            config.VOTE_BUTTONS = buttons
+            config.client.http.calls = 0
+            channel = FakeChannel()
+
+            start = time.perf_counter()
+
+            for _ in range(num_polls):
+                await auxiliary.send_poll_message(channel, 'Poll', options)
+
+            total = time.perf_counter() - start
+
+            print('%-10s %8d %14.1f %14.1f' % (name, num_options, config.client.http.calls / num_polls,
+                                                total / num_polls * 1000))
+
+
+asyncio.run(main())
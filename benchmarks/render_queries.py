@@ -0,0 +1,41 @@
+"""
+Number of queries used to render a poll.
+
+Counts the statements sent to the DB by create_message for polls with a different number of options, failing when the
+number of queries grows with the number of options.
+
+Usage: python3 benchmarks/render_queries.py
+"""
+
+import sys
+
+from common import create_fake_poll, setup_database
+
+config = setup_database()
+
+import auxiliary
+
+from sqlalchemy import event
+
+statements = []
+
+
+@event.listens_for(config.engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, *args):
+    statements.append(statement)
+
+
+counts = {}
+
+for num_options in (2, 9, 50):
+    poll, options = create_fake_poll(config.session, 'render%d' % num_options, num_options, 100)
+
+    statements.clear()
+    auxiliary.create_message(poll, options)
+    counts[num_options] = len(statements)
+
+    print('%d options: %d queries' % (num_options, counts[num_options]))
+
+if len(set(counts.values())) != 1:
+    print('The number of queries grows with the number of options!')
+    sys.exit(1)
@@ -0,0 +1,621 @@
+"""
+Throughput of the bot replaying a trace of gateway events.
+
+Replays a JSONL trace of messages, reactions and replies through the handlers of poll_me_bot, at a fixed rate and
+without waiting for the previous events to finish, against a fake Discord that adds a delay to each request. Reports
+the events handled per second, the latency of the handlers and the number of queries to the DB and requests to
+Discord. A synthetic trace can be generated with --generate.
+
+Each line of the trace is an event:
+{"type": "message", "server": 1, "channel": 1, "author": 10, "content": "!poll key \\"Question?\\" A B"}
+{"type": "reaction_add", "server": 1, "channel": 1, "user": 10, "to": "poll:key", "emoji": "1\\u20e3"}
+{"type": "reaction_remove", "server": 1, "channel": 1, "user": 10, "to": "poll:key", "emoji": "1\\u20e3"}
+{"type": "reply", "server": 1, "channel": 1, "author": 10, "content": "Dinner", "to": "last:key:create_poll"}
+{"type": "button", "server": 1, "channel": 1, "user": 10, "to": "poll:key", "option": 1}
+{"type": "wait"}
+Messages of the bot are referenced by the key of their poll or as the last message the bot sent in the channel with a
+text, last: for any text, and the events wait for them when the previous events are still sending them. Messages sent
+by members can also use "admin": true. A wait waits for all the events before it to finish.
+Fails when an event raises an exception or the bot rejects one of the commands of the trace and, with --strict, when
+an event makes more queries to the DB than its budget.
+
+Usage: python3 benchmarks/replay.py trace.jsonl [--rate 50] [--round-trip-ms 50] [--verbose] [--strict]
+       python3 benchmarks/replay.py --generate trace.jsonl [--events 2000] [--polls 20] [--seed 1]
+"""
+
+import argparse
+import asyncio
+import collections
+import contextlib
+import io
+import itertools
+import json
+import random
+import re
+import sys
+import time
+import traceback
+import types
+
+from common import percentile, setup_database
+
+config = setup_database()
+
+import discord
+
+from sqlalchemy import event
+
+# Time an event waits for the message it refers to, sent by the previous events
+TARGET_TIMEOUT_SEC = 5
+
+# Start of the replies of the bot to commands that it did not carry out
+REJECTIONS = ('Invalid parameters', 'There\'s no poll', 'Only ', 'models.Poll *', 'A poll with that id',
+              'The server you\'re in')
+
+
+class FakeResponse:
+    """Response of the fake Discord to a request that failed."""
+
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+
+
+class FakeUser:
+    def __init__(self, user_id, name, administrator=False):
+        self.id = user_id
+        self.name = name
+        self.mention = '<@%s>' % user_id
+        self.guild_permissions = types.SimpleNamespace(administrator=administrator)
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.name = 'Server %d' % guild_id
+
+    def get_member(self, user_id):
+        # The members are not simulated, so no private messages are sent
+        return None
+
+
+class FakeMessage:
+    """A message, or a partial message when only its id is known, changed through the requests to the fake Discord."""
+
+    def __init__(self, message_id, channel, author, content=None, reference=None):
+        self.id = message_id
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.reference = reference
+
+    async def edit(self, content):
+        await config.client.http.edit_message(self.channel.id, self.id, content=content)
+        self.content = content
+
+    async def delete(self):
+        await config.client.http.delete_message(self.channel.id, self.id)
+
+    async def add_reaction(self, emoji):
+        await config.client.http.add_reaction(self.channel.id, self.id, emoji)
+
+    async def clear_reaction(self, emoji):
+        await config.client.http.clear_single_reaction(self.channel.id, self.id, emoji)
+
+    async def clear_reactions(self):
+        await config.client.http.clear_reactions(self.channel.id, self.id)
+
+
+class FakeChannel:
+    def __init__(self, channel_id, guild):
+        self.id = channel_id
+        self.guild = guild
+        self.name = 'channel-%d' % channel_id
+        self.mention = '<#%s>' % channel_id
+
+        # The members are not simulated, so no private messages are sent
+        self.members = []
+
+        # The messages in the channel, by id, in the order they were sent
+        self.messages = {}
+
+    async def send(self, content, delete_after=None, file=None):
+        route = discord.http.Route('POST', '/channels/{channel_id}/messages', channel_id=self.id)
+        data = await config.client.http.request(route, json={'content': content})
+
+        return self.messages[int(data['id'])]
+
+    async def fetch_message(self, message_id):
+        await config.client.http.get_message(self.id, message_id)
+
+        return self.messages[message_id]
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(message_id, self, config.client.user)
+
+    def last_message_by(self, author):
+        """Get the last message of an author that was not deleted, or None."""
+
+        for message in reversed(list(self.messages.values())):
+            if message.author == author:
+                return message
+
+        return None
+
+
+class FakeHTTP:
+    """Requests to a fake Discord, which keeps the messages of the channels and counts the requests by route."""
+
+    def __init__(self, client, round_trip_sec):
+        self.client = client
+        self.round_trip_sec = round_trip_sec
+        self.calls = collections.Counter()
+        self.message_ids = itertools.count(10 ** 15)
+
+        # Replies to commands that were not carried out, by the start of the reply
+        self.rejections = collections.Counter()
+
+    async def request(self, route, json=None, **kwargs):
+        self.calls['%s %s' % (route.method, route.path)] += 1
+        await asyncio.sleep(self.round_trip_sec)
+
+        # New message, sent by discord.py or directly when it has buttons
+        if route.method == 'POST' and route.path == '/channels/{channel_id}/messages':
+            channel = self.client.get_channel(route.channel_id)
+            message = FakeMessage(next(self.message_ids), channel, self.client.user, json['content'])
+
+            channel.messages[message.id] = message
+            self.client.index(message)
+
+            for rejection in REJECTIONS:
+                if json['content'].startswith(rejection):
+                    self.rejections[rejection] += 1
+
+            return {'id': str(message.id)}
+
+        return {}
+
+    def find(self, channel_id, message_id):
+        """Get a message in a channel, failing as Discord does when it does not exist."""
+
+        message = self.client.get_channel(channel_id).messages.get(message_id)
+
+        if message is None:
+            raise discord.errors.NotFound(FakeResponse(404, 'Not Found'), 'Unknown Message')
+
+        return message
+
+    async def get_message(self, channel_id, message_id):
+        await self.request(discord.http.Route('GET', '/channels/{channel_id}/messages/{message_id}',
+                                              channel_id=channel_id, message_id=message_id))
+        self.find(channel_id, message_id)
+
+    async def edit_message(self, channel_id, message_id, **fields):
+        await self.request(discord.http.Route('PATCH', '/channels/{channel_id}/messages/{message_id}',
+                                              channel_id=channel_id, message_id=message_id), json=fields)
+        message = self.find(channel_id, message_id)
+
+        if 'content' in fields:
+            message.content = fields['content']
+            self.client.index(message)
+
+    async def delete_message(self, channel_id, message_id):
+        await self.request(discord.http.Route('DELETE', '/channels/{channel_id}/messages/{message_id}',
+                                              channel_id=channel_id, message_id=message_id))
+        self.find(channel_id, message_id)
+
+        del self.client.get_channel(channel_id).messages[message_id]
+
+    async def add_reaction(self, channel_id, message_id, emoji):
+        await self.request(discord.http.Route('PUT', '/channels/{channel_id}/messages/{message_id}/reactions/'
+                                                     '{emoji}/@me', channel_id=channel_id, message_id=message_id,
+                                              emoji=emoji))
+        self.find(channel_id, message_id)
+
+    async def clear_single_reaction(self, channel_id, message_id, emoji):
+        await self.request(discord.http.Route('DELETE', '/channels/{channel_id}/messages/{message_id}/reactions/'
+                                                        '{emoji}', channel_id=channel_id, message_id=message_id,
+                                              emoji=emoji))
+        self.find(channel_id, message_id)
+
+    async def clear_reactions(self, channel_id, message_id):
+        await self.request(discord.http.Route('DELETE', '/channels/{channel_id}/messages/{message_id}/reactions',
+                                              channel_id=channel_id, message_id=message_id))
+        self.find(channel_id, message_id)
+
+
+class FakeClient:
+    """The client of discord.py, with the channels of the trace and the fake Discord."""
+
+    def __init__(self, round_trip_sec):
+        self.user = FakeUser(1, 'Poll Me Bot')
+        self.http = FakeHTTP(self, round_trip_sec)
+
+        self.guilds = {}
+        self.channels = {}
+        self.users = {}
+
+        # Id of the message of each poll, by poll key
+        self.poll_messages = {}
+
+    def event(self, handler):
+        return handler
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_or_create_channel(self, channel_id, guild_id):
+        if channel_id not in self.channels:
+            guild = self.guilds.setdefault(guild_id, FakeGuild(guild_id))
+            self.channels[channel_id] = FakeChannel(channel_id, guild)
+
+        return self.channels[channel_id]
+
+    def get_or_create_user(self, user_id, administrator=False):
+        if user_id not in self.users:
+            self.users[user_id] = FakeUser(user_id, 'user%d' % user_id, administrator)
+
+        return self.users[user_id]
+
+    def index(self, message):
+        """Keep the id of the message of a poll, found through its content."""
+
+        match = re.search(r'\(poll_key: ([^)]+)\)', message.content or '')
+
+        if match is not None:
+            self.poll_messages[match.group(1)] = message.id
+
+
+# The handlers use the fake client, which must be in place before they are registered
+config.client = FakeClient(0)
+
+import edits
+import poll_me_bot
+import profiling
+
+queries = 0
+
+
+@event.listens_for(config.engine, 'before_cursor_execute')
+def before_cursor_execute(*args):
+    global queries
+    queries += 1
+
+
+def find_target(channel, to):
+    """
+    Find the message of the bot an event refers to.
+
+    :param channel: the FakeChannel of the event.
+    :param to: the reference in the trace, poll:<key> or last:<text>.
+    :return: the message or None, if it does not exist yet.
+    """
+
+    if to.startswith('poll:'):
+        message_id = config.client.poll_messages.get(to[len('poll:'):])
+
+        if message_id is None:
+            return None
+
+        return channel.messages.get(message_id) or channel.get_partial_message(message_id)
+
+    # The last message of the bot with the text, or just the last one
+    text = to.partition(':')[2]
+
+    for message in reversed(list(channel.messages.values())):
+        if message.author == config.client.user and text in message.content:
+            return message
+
+    return None
+
+
+async def wait_for_target(channel, to):
+    """
+    Wait for the message of the bot an event refers to, which the previous events may still be sending.
+
+    :param channel: the FakeChannel of the event.
+    :param to: the reference in the trace.
+    :return: the message or None, if it was not sent in time.
+    """
+
+    deadline = time.perf_counter() + TARGET_TIMEOUT_SEC
+
+    while time.perf_counter() < deadline:
+        target = find_target(channel, to)
+
+        if target is not None:
+            return target
+
+        await asyncio.sleep(0.01)
+
+    return None
+
+
+async def create_handler_call(entry, message_ids):
+    """
+    Create the call to the handler of an event of the trace.
+
+    :param entry: the event.
+    :param message_ids: the ids of the messages sent by the members.
+    :return: the coroutine of the handler or None, if the message it refers to was not found.
+    """
+
+    channel = config.client.get_or_create_channel(entry['channel'], entry['server'])
+    target = None
+
+    if 'to' in entry:
+        target = await wait_for_target(channel, entry['to'])
+
+        if target is None:
+            return None
+
+    if entry['type'] in ('message', 'reply'):
+        author = config.client.get_or_create_user(entry['author'], entry.get('admin', False))
+        reference = None
+
+        if entry['type'] == 'reply':
+            # The gateway sends the message being replied with the reply
+            reference = discord.MessageReference(message_id=target.id, channel_id=channel.id,
+                                                 guild_id=channel.guild.id)
+            reference.resolved = target
+
+        message = FakeMessage(next(message_ids), channel, author, entry['content'], reference)
+        channel.messages[message.id] = message
+
+        return poll_me_bot.on_message(message)
+
+    if entry['type'] == 'button':
+        interaction = {'type': 3, 'id': str(next(message_ids)), 'token': 'replay', 'channel_id': str(channel.id),
+                       'guild_id': str(channel.guild.id), 'member': {'user': {'id': str(entry['user'])}},
+                       'message': {'id': str(target.id)}, 'data': {'custom_id': 'vote:%d' % entry['option']}}
+
+        return poll_me_bot.on_socket_response({'t': 'INTERACTION_CREATE', 'd': interaction})
+
+    event_type = 'REACTION_ADD' if entry['type'] == 'reaction_add' else 'REACTION_REMOVE'
+    payload = discord.RawReactionActionEvent({'message_id': target.id, 'channel_id': channel.id,
+                                              'user_id': entry['user'], 'guild_id': channel.guild.id},
+                                             discord.PartialEmoji(name=entry['emoji']), event_type)
+
+    if entry['type'] == 'reaction_add':
+        return poll_me_bot.on_raw_reaction_add(payload)
+
+    return poll_me_bot.on_raw_reaction_remove(payload)
+
+
+async def replay(trace, rate):
+    """
+    Replay the events of a trace at a fixed rate.
+
+    :param trace: the events.
+    :param rate: the number of events started per second.
+    :return: the latency of each event by type, the events that were not found and the errors, and the total time.
+    """
+
+    latencies = collections.defaultdict(list)
+    skipped = collections.Counter()
+    errors = collections.Counter()
+    message_ids = itertools.count(10 ** 16)
+
+    async def run(entry):
+        call = await create_handler_call(entry, message_ids)
+
+        if call is None:
+            skipped[entry['type']] += 1
+            return
+
+        start = time.perf_counter()
+
+        try:
+            await call
+        except Exception as e:
+            error = '%s: %s' % (entry['type'], type(e).__name__)
+            errors[error] += 1
+
+            # Show the first time each error happens
+            if errors[error] == 1:
+                traceback.print_exc()
+
+        latencies[entry['type']].append(time.perf_counter() - start)
+
+    # Reactions to messages that are not polls are then ignored, as after on_ready
+    await poll_me_bot.load_poll_messages()
+
+    tasks = []
+    start = time.perf_counter()
+
+    for i, entry in enumerate(trace):
+        # Wait for all the events before, such as the creation of the polls before voting in them
+        if entry['type'] == 'wait':
+            await asyncio.gather(*tasks)
+            start = time.perf_counter() - i / rate
+            continue
+
+        # Start the events on time, regardless of the ones still running
+        wait = start + i / rate - time.perf_counter()
+
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        tasks.append(asyncio.create_task(run(entry)))
+
+    await asyncio.gather(*tasks)
+    total = time.perf_counter() - start
+
+    # Let the edits of the messages of the polls finish
+    while edits.scheduler.pending:
+        await asyncio.sleep(0.1)
+
+    return latencies, skipped, errors, total
+
+
+def generate(path, num_events, num_polls, seed):
+    """
+    Write a synthetic trace: the configuration of the channels and the creation of the polls, then votes with
+    reactions and commands, a few interactive polls and other messages, and finally the closing of half of the polls.
+
+    :param path: the file of the trace.
+    :param num_events: the number of events after the creation of the polls.
+    :param num_polls: the number of polls.
+    :param seed: the seed of the random choices, the same seed generates the same trace.
+    """
+
+    rng = random.Random(seed)
+    trace = []
+    polls = []
+
+    # Each channel is in its own server, below the limit of polls per server
+    num_channels = max(num_polls // 10, 1)
+
+    # Configured first, so that the polls do not all try to create their channel
+    for c in range(num_channels):
+        trace.append({'type': 'message', 'server': 100 + c, 'channel': 100 + c, 'author': 999, 'admin': True,
+                      'content': '!poll_channel -ka'})
+
+    trace.append({'type': 'wait'})
+
+    for p in range(num_polls):
+        channel = 100 + p % num_channels
+        num_options = rng.choice((2, 5, 9))
+        multiple_options = rng.random() < 0.5
+        key = 'replay%d_%d' % (seed, p)
+
+        polls.append((key, channel, num_options))
+        trace.append({'type': 'message', 'server': channel, 'channel': channel, 'author': 1000 + p,
+                      'content': '!poll %s%s "Question %d?" %s'
+                                 % ('-m ' if multiple_options else '', key, p,
+                                    ' '.join('"Option %d"' % (o + 1) for o in range(num_options)))})
+
+    trace.append({'type': 'wait'})
+
+    reactions = []
+    later = []
+    flows = itertools.count(1)
+
+    for i in range(num_events):
+        # The next step of an interactive poll, once the previous one had time to finish
+        if later and later[0][0] <= i:
+            trace.append(later.pop(0)[1])
+            continue
+
+        key, channel, num_options = rng.choice(polls)
+        user = 10 ** 6 + rng.randrange(10 ** 4)
+        kind = rng.random()
+        entry = {'server': channel, 'channel': channel}
+
+        if kind < 0.6 or (kind < 0.8 and not reactions):
+            option = rng.randint(1, num_options)
+            reactions.append((key, channel, user, option))
+            entry.update(type='reaction_add', user=user, to='poll:%s' % key, emoji='%d\u20e3' % option)
+        elif kind < 0.8:
+            key, channel, user, option = reactions.pop(rng.randrange(len(reactions)))
+            entry.update(server=channel, channel=channel, type='reaction_remove', user=user, to='poll:%s' % key,
+                         emoji='%d\u20e3' % option)
+        elif kind < 0.9:
+            options = ','.join(str(rng.randint(1, num_options)) for _ in range(rng.randint(1, 3)))
+            entry.update(type='message', author=user, content='!vote %s %s' % (key, options))
+        elif kind < 0.95:
+            entry.update(type='message', author=user, content='!unvote %s %d' % (key, rng.randint(1, num_options)))
+        elif kind < 0.99:
+            entry.update(type='message', author=user, content='Just chatting')
+        else:
+            # An interactive poll, in a channel of its own so that the last message of the bot is the right one
+            flow = 10 ** 5 + next(flows)
+            steps = [{'type': 'reaction_add', 'user': user, 'to': 'last:key:menu', 'emoji': '1\u20e3'},
+                     {'type': 'reply', 'author': user, 'to': 'last:key:create_poll', 'content': 'Dinner'},
+                     {'type': 'reply', 'author': user, 'to': 'last:key:add_options', 'content': 'Pizza,Sushi,Ramen'}]
+
+            entry = {'type': 'message', 'server': flow, 'channel': flow, 'author': user, 'content': '!help_me_poll'}
+
+            for s, step in enumerate(steps):
+                step.update(server=flow, channel=flow)
+                later.append((i + 25 * (s + 1), step))
+
+            later.sort(key=lambda pending: pending[0])
+
+        trace.append(entry)
+
+    trace.extend(step for _, step in later)
+
+    for p, (key, channel, _) in enumerate(polls[::2]):
+        trace.append({'type': 'message', 'server': channel, 'channel': channel, 'author': 1000 + 2 * p,
+                      'content': '!poll_close %s 1' % key})
+
+    with open(path, 'w') as f:
+        for entry in trace:
+            f.write(json.dumps(entry) + '\n')
+
+    print('%d events written to %s.' % (sum(1 for entry in trace if entry['type'] != 'wait'), path))
+
+
+async def main(args):
+    with open(args.trace) as f:
+        trace = [json.loads(line) for line in f if line.strip()]
+
+    config.client.http.round_trip_sec = args.round_trip_ms / 1000
+
+    # The events over their budget raise, as with STRICT_QUERY_BUDGETS=1
+    config.strict_query_budgets = args.strict
+
+    # The handlers report each event, which is too much for a replay
+    output = sys.stdout if args.verbose else io.StringIO()
+
+    with contextlib.redirect_stdout(output):
+        latencies, skipped, errors, total = await replay(trace, args.rate)
+
+    handled = sum(len(values) for values in latencies.values())
+
+    num_events = sum(1 for entry in trace if entry['type'] != 'wait')
+
+    print('%d events at %.1f per second, %.1f ms per request' % (num_events, args.rate, args.round_trip_ms))
+    print('Handled %d events in %.2fs: %.1f events per second' % (handled, total, handled / total))
+    print('%-16s %8s %12s %12s %12s' % ('event', 'count', 'p50 ms', 'p99 ms', 'max ms'))
+
+    for event_type, values in sorted(latencies.items()):
+        print('%-16s %8d %12.2f %12.2f %12.2f' % (event_type, len(values), percentile(values, 50) * 1000,
+                                                  percentile(values, 99) * 1000, max(values) * 1000))
+
+    print('DB queries: %d (%.2f per event)' % (queries, queries / max(handled, 1)))
+
+    calls = config.client.http.calls
+    print('Discord requests: %d (%.2f per event)' % (sum(calls.values()), sum(calls.values()) / max(handled, 1)))
+
+    for route, count in calls.most_common():
+        print('    %6d %s' % (count, route))
+
+    if skipped:
+        print('Events whose message was not found: %s' % dict(skipped))
+
+    if config.client.http.rejections:
+        print('Commands that were rejected: %s' % dict(config.client.http.rejections))
+
+    # Counted also for the tasks started by the events, where the exception does not reach the replay
+    over_budget = profiling.budgets_exceeded.value
+
+    if over_budget > 0:
+        print('Events over their query budget: %d' % over_budget)
+
+    if errors:
+        print('Events that failed: %s' % dict(errors))
+
+    if errors or config.client.http.rejections or (args.strict and over_budget > 0):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput of the bot replaying a trace of gateway events.')
+    parser.add_argument('trace', help='file of the trace, in JSONL')
+    parser.add_argument('--rate', type=float, default=50, help='number of events started per second')
+    parser.add_argument('--round-trip-ms', type=float, default=50, help='delay of each request to Discord')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the handlers')
+    parser.add_argument('--strict', action='store_true', help='fail when an event goes over its query budget')
+    parser.add_argument('--generate', action='store_true', help='write a synthetic trace to the file instead')
+    parser.add_argument('--events', type=int, default=2000, help='number of events of the synthetic trace')
+    parser.add_argument('--polls', type=int, default=20, help='number of polls of the synthetic trace')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic trace')
+    args = parser.parse_args()
+
+    if args.generate:
+        generate(args.trace, args.events, args.polls, args.seed)
+    else:
+        asyncio.run(main(args))
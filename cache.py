@@ -0,0 +1,444 @@
+import threading
+import time
+from collections import OrderedDict
+
+import configuration as config
+
+# Returned when something is not in the cache
+NOT_CACHED = object()
+
+
+class CachedOption:
+    """Copy of an option of a poll, kept in memory."""
+
+    def __init__(self, option):
+        self.id = option.id
+        self.poll_id = option.poll_id
+        self.position = option.position
+        self.option_text = option.option_text
+        self.locked = option.locked
+
+
+class CachedPoll:
+    """Copy of a poll, its options and the participants that voted in each option, kept in memory."""
+
+    fields = ['id', 'poll_key', 'question', 'multiple_options', 'only_numbers', 'new_options', 'allow_external',
+              'closed', 'closed_date', 'channel_id', 'discord_server_id', 'discord_author_id', 'discord_message_id']
+
+    def __init__(self, poll, options, votes):
+        for field in CachedPoll.fields:
+            setattr(self, field, getattr(poll, field))
+
+        self.options = [CachedOption(o) for o in options]
+
+        # The participants of each option, by option id, in the order they voted
+        # int means discord user
+        # string means external participant
+        self.voters = {}
+
+        for o in options:
+            self.voters[o.id] = dict.fromkeys(votes[o.id])
+
+        self.last_used = time.monotonic()
+
+
+class PollCache:
+    """Cache of the active polls, evicting the least recently used and the ones that have been idle for too long."""
+
+    def __init__(self, max_size, max_idle_sec):
+        self.max_size = max_size
+        self.max_idle_sec = max_idle_sec
+
+        self.polls = OrderedDict()
+        self.poll_by_message = {}
+
+        self.lock = threading.Lock()
+
+    def get(self, poll_id):
+        """
+        Get a poll from the cache.
+
+        :param poll_id: the id of the poll in the DB.
+        :return: the CachedPoll or None, if the poll is not in the cache.
+        """
+
+        with self.lock:
+            self.evict_idle()
+
+            entry = self.polls.get(poll_id)
+
+            if entry is not None:
+                entry.last_used = time.monotonic()
+                self.polls.move_to_end(poll_id)
+
+            return entry
+
+    def get_by_message(self, discord_message_id):
+        """
+        Get a poll from the cache, using the id of its Discord message.
+
+        :param discord_message_id: the id of the message of the poll.
+        :return: the CachedPoll or None, if the poll is not in the cache.
+        """
+
+        poll_id = self.poll_by_message.get(discord_message_id)
+
+        if poll_id is None:
+            return None
+
+        return self.get(poll_id)
+
+    def put(self, poll, options, votes):
+        """
+        Add a poll to the cache.
+
+        :param poll: the poll.
+        :param options: the options available in the poll.
+        :param votes: the participants of each option, by option id.
+        :return: the CachedPoll.
+        """
+
+        entry = CachedPoll(poll, options, votes)
+
+        with self.lock:
+            self.remove(poll.id)
+
+            self.polls[poll.id] = entry
+
+            if entry.discord_message_id is not None:
+                self.poll_by_message[entry.discord_message_id] = poll.id
+
+            self.evict_idle()
+
+            while len(self.polls) > self.max_size:
+                self.remove(next(iter(self.polls)))
+
+        return entry
+
+    def invalidate(self, poll_id):
+        """
+        Remove a poll from the cache, because it was changed.
+
+        :param poll_id: the id of the poll in the DB.
+        """
+
+        with self.lock:
+            self.remove(poll_id)
+
+        renders.changed(poll_id)
+
+    def add_voter(self, poll_id, option_id, poll_participant):
+        """
+        Add a participant to the voters of an option of a cached poll.
+
+        :param poll_id: the id of the poll in the DB.
+        :param option_id: the id of the option in the DB.
+        :param poll_participant: the id of the participant.
+        """
+
+        with self.lock:
+            entry = self.polls.get(poll_id)
+
+            if entry is not None and option_id in entry.voters:
+                entry.voters[option_id][poll_participant] = None
+
+        renders.changed(poll_id)
+
+    def remove_voter(self, poll_id, option_id, poll_participant):
+        """
+        Remove a participant from the voters of an option of a cached poll.
+
+        :param poll_id: the id of the poll in the DB.
+        :param option_id: the id of the option in the DB.
+        :param poll_participant: the id of the participant.
+        """
+
+        with self.lock:
+            entry = self.polls.get(poll_id)
+
+            if entry is not None and option_id in entry.voters:
+                entry.voters[option_id].pop(poll_participant, None)
+
+        renders.changed(poll_id)
+
+    def remove(self, poll_id):
+        """Remove a poll from the cache, the lock must be held."""
+
+        entry = self.polls.pop(poll_id, None)
+
+        if entry is not None:
+            self.poll_by_message.pop(entry.discord_message_id, None)
+
+    def evict_idle(self):
+        """Remove the polls that have not been used recently, the lock must be held."""
+
+        now = time.monotonic()
+
+        while self.polls:
+            entry = next(iter(self.polls.values()))
+
+            if now - entry.last_used <= self.max_idle_sec:
+                break
+
+            self.remove(entry.id)
+
+
+class RenderedPoll:
+    """The last message rendered for a poll."""
+
+    def __init__(self):
+        # Increased with every change to the poll
+        self.version = 0
+
+        self.rendered_version = None
+        self.content = None
+
+
+class RenderCache:
+    """
+    Cache of the last message rendered for each poll, valid while the version of the poll does not change, and of the
+    content each message of a poll shows in Discord.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+
+        self.polls = OrderedDict()
+        self.shown = OrderedDict()
+
+        self.lock = threading.Lock()
+
+    def version(self, poll_id):
+        """
+        Get the current version of a poll, to render it.
+
+        :param poll_id: the id of the poll in the DB.
+        :return: the version.
+        """
+
+        with self.lock:
+            entry = self.polls.get(poll_id)
+
+            if entry is None:
+                entry = RenderedPoll()
+                self.polls[poll_id] = entry
+
+                while len(self.polls) > self.max_size:
+                    self.polls.popitem(last=False)
+            else:
+                self.polls.move_to_end(poll_id)
+
+            return entry.version
+
+    def changed(self, poll_id):
+        """
+        Mark a poll as changed, so that it is rendered again.
+
+        :param poll_id: the id of the poll in the DB.
+        """
+
+        with self.lock:
+            entry = self.polls.get(poll_id)
+
+            if entry is not None:
+                entry.version += 1
+
+    def get(self, poll_id):
+        """
+        Get the last message rendered for a poll, if the poll did not change since.
+
+        :param poll_id: the id of the poll in the DB.
+        :return: the message and the id of the message of the poll it is for or None, if it needs to be rendered.
+        """
+
+        with self.lock:
+            entry = self.polls.get(poll_id)
+
+            if entry is None or entry.rendered_version != entry.version:
+                return None
+
+            return entry.content
+
+    def put(self, poll_id, version, content):
+        """
+        Keep the message rendered for a poll.
+
+        :param poll_id: the id of the poll in the DB.
+        :param version: the version of the poll when the rendering started.
+        :param content: the message and the id of the message of the poll it is for.
+        """
+
+        with self.lock:
+            entry = self.polls.get(poll_id)
+
+            # Changes during the rendering may be missing
+            if entry is not None and entry.version == version:
+                entry.rendered_version = version
+                entry.content = content
+
+    def is_shown(self, discord_message_id, content):
+        """
+        Check if the message of a poll already shows a content in Discord.
+
+        :param discord_message_id: the id of the message of the poll.
+        :param content: the content.
+        :return: True if it is known to show that content.
+        """
+
+        with self.lock:
+            return self.shown.get(discord_message_id) == content
+
+    def set_shown(self, discord_message_id, content):
+        """
+        Keep the content shown by the message of a poll in Discord.
+
+        :param discord_message_id: the id of the message of the poll.
+        :param content: the content.
+        """
+
+        with self.lock:
+            self.shown[discord_message_id] = content
+            self.shown.move_to_end(discord_message_id)
+
+            while len(self.shown) > self.max_size:
+                self.shown.popitem(last=False)
+
+
+class CachedChannel:
+    """Copy of the settings of a channel, kept in memory."""
+
+    def __init__(self, channel):
+        self.id = channel.id
+        self.discord_id = channel.discord_id
+        self.discord_server_id = channel.discord_server_id
+        self.delete_commands = channel.delete_commands
+        self.delete_all = channel.delete_all
+
+
+class ChannelCache:
+    """Cache of the settings of the channels, including the ones that are not in the DB, by Discord id."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+
+        self.channels = OrderedDict()
+
+        self.lock = threading.Lock()
+
+    def get(self, discord_id):
+        """
+        Get a channel from the cache.
+
+        :param discord_id: the id of the Discord channel.
+        :return: the CachedChannel, None if the channel is not in the DB or NOT_CACHED.
+        """
+
+        with self.lock:
+            entry = self.channels.get(discord_id, NOT_CACHED)
+
+            if entry is not NOT_CACHED:
+                self.channels.move_to_end(discord_id)
+
+            return entry
+
+    def put(self, discord_id, channel):
+        """
+        Add a channel to the cache.
+
+        :param discord_id: the id of the Discord channel.
+        :param channel: the channel in the DB or None, if the channel is not in the DB.
+        :return: the CachedChannel or None.
+        """
+
+        entry = CachedChannel(channel) if channel is not None else None
+
+        with self.lock:
+            self.channels[discord_id] = entry
+            self.channels.move_to_end(discord_id)
+
+            while len(self.channels) > self.max_size:
+                self.channels.popitem(last=False)
+
+        return entry
+
+    def invalidate(self, discord_id):
+        """
+        Remove a channel from the cache, because it was changed.
+
+        :param discord_id: the id of the Discord channel.
+        """
+
+        with self.lock:
+            self.channels.pop(discord_id, None)
+
+
+class PollIndex:
+    """Index of the messages of all polls, so that reactions to other messages are ignored without the DB."""
+
+    def __init__(self):
+        self.poll_by_message = {}
+        self.loaded = False
+
+    def load(self, polls):
+        """
+        Add all polls in the DB to the index.
+
+        :param polls: the list of pairs with the id of the message and the id of the poll.
+        """
+
+        for discord_message_id, poll_id in polls:
+            self.poll_by_message[discord_message_id] = poll_id
+
+        self.loaded = True
+
+    def add(self, discord_message_id, poll_id):
+        """
+        Add the message of a poll to the index.
+
+        :param discord_message_id: the id of the message of the poll.
+        :param poll_id: the id of the poll in the DB.
+        """
+
+        self.poll_by_message[discord_message_id] = poll_id
+
+    def get(self, discord_message_id):
+        """
+        Get the poll of a message.
+
+        :param discord_message_id: the id of the message.
+        :return: the id of the poll in the DB or None, if the message is not in the index.
+        """
+
+        return self.poll_by_message.get(discord_message_id)
+
+    def remove(self, discord_message_id):
+        """
+        Remove the message of a poll from the index.
+
+        :param discord_message_id: the id of the message of the poll.
+        """
+
+        self.poll_by_message.pop(discord_message_id, None)
+
+    def may_be_poll(self, discord_message_id):
+        """
+        Check if a message may be the message of a poll.
+
+        :param discord_message_id: the id of the message.
+        :return: False if it is known not to be a poll.
+        """
+
+        return not self.loaded or discord_message_id in self.poll_by_message
+
+
+# Cache of the active polls
+polls = PollCache(config.POLL_CACHE_SIZE, config.POLL_CACHE_IDLE_SEC)
+
+# Index of the messages of all polls
+poll_messages = PollIndex()
+
+# Cache of the messages of the polls
+renders = RenderCache(config.RENDER_CACHE_SIZE)
+
+# Cache of the settings of the channels
+channels = ChannelCache(config.CHANNEL_CACHE_SIZE)
@@ -3,11 +3,19 @@ import datetime
 import discord
 
 import auxiliary
+import cache
 import configuration as config
+import database
+import edits
 import interactive
 import models
+import monitoring
+import notifications
+import profiling
 
 
+@monitoring.handler_durations.timed
+@profiling.query_budget(5)
 async def configure_channel_command(command, db_channel):
     """
     Configure a channel with the given settings.
@@ -51,17 +59,23 @@ async def configure_channel_command(command, db_channel):
     if db_channel is None:
         db_channel = models.Channel(discord_channel_id, discord_server_id, delete_commands, delete_all)
 
-        config.session.add(db_channel)
+        await database.run(config.session.add, db_channel)
     else:
+        db_channel = await database.run(config.session.query(models.Channel).get, db_channel.id)
+
         db_channel.delete_commands = delete_commands
         db_channel.delete_all = delete_all
 
-    config.session.commit()
+    await database.run(config.session.commit)
+
+    cache.channels.invalidate(discord_channel_id)
 
     print('Channel %s from %s was configured -> %s!' % (
         command.channel.name, command.guild.name, command.content))
 
 
+@monitoring.handler_durations.timed
+@profiling.query_budget(25)
 async def create_poll_command(command, db_channel):
     """
     Create a new poll.
@@ -75,7 +89,7 @@ async def create_poll_command(command, db_channel):
 
     # Create channel if it does not already exist
     if db_channel is None:
-        db_channel = auxiliary.create_channel(command)
+        db_channel = await database.run(auxiliary.create_channel, command)
 
     # Get the list of parameters in the message
     params = auxiliary.parse_command_parameters(command.content)
@@ -133,7 +147,7 @@ async def create_poll_command(command, db_channel):
         return
 
     # Get the poll with this id
-    poll = config.session.query(models.Poll).filter(models.Poll.poll_key == poll_params[0]).first()
+    poll = await database.run(config.session.query(models.Poll).filter(models.Poll.poll_key == poll_params[0]).first)
 
     # If a poll with the same id already exists, delete it
     if poll is not None:
@@ -153,12 +167,14 @@ async def create_poll_command(command, db_channel):
             await auxiliary.send_temp_message(msg, command.channel)
             return
 
-    num_polls = config.session.query(models.Poll).filter(models.Poll.discord_server_id == discord_server_id).count()
+    num_polls = await database.run(
+        config.session.query(models.Poll).filter(models.Poll.discord_server_id == discord_server_id).count)
 
     # Limit the number of polls per server
     if num_polls >= config.POLL_LIMIT_SERVER:
-        polls = config.session.query(models.Poll).filter(models.Poll.discord_server_id == discord_server_id) \
-            .filter(models.Poll.discord_author_id == command.author.id).all()
+        polls = await database.run(config.session.query(models.Poll)
+                                   .filter(models.Poll.discord_server_id == discord_server_id)
+                                   .filter(models.Poll.discord_author_id == command.author.id).all)
 
         msg = 'The server you\'re in has reached its poll limit, creating another poll is not possible.'
 
@@ -180,19 +196,10 @@ async def create_poll_command(command, db_channel):
     new_poll = models.Poll(poll_params[0], command.author.id, poll_params[1], multiple_options, only_numbers,
                            new_options, allow_external, db_channel.id, discord_server_id)
 
-    config.session.add(new_poll)
-
-    # Send a private message to each member in the server
-    for m in command.channel.members:
-        if m != config.client.user and m.id != new_poll.discord_author_id:
-            try:
-                await m.send('A new poll (%s) has been created in %s!'
-                             % (new_poll.poll_key, command.channel.mention))
-            except (discord.errors.Forbidden, discord.errors.HTTPException):
-                pass
+    await database.run(config.session.add, new_poll)
 
     # Necessary for the options to get the poll id
-    config.session.flush()
+    await database.run(config.session.flush)
 
     options = []
 
@@ -236,21 +243,28 @@ async def create_poll_command(command, db_channel):
         options.append(models.Option(new_poll.id, 1, 'Yes'))
         options.append(models.Option(new_poll.id, 2, 'No'))
 
-    config.session.add_all(options)
+    await database.run(config.session.add_all, options)
 
     # Create the message with the poll
-    msg = await command.channel.send(auxiliary.create_message(new_poll, options))
+    msg = await auxiliary.send_poll_message(command.channel,
+                                            await database.run(auxiliary.create_message, new_poll, options), options)
 
     new_poll.discord_message_id = msg.id
+    cache.poll_messages.add(msg.id, new_poll.id)
+
+    await database.run(config.session.commit)
 
-    # Add a reaction for each option
-    await auxiliary.add_options_reactions(msg, options)
+    # Send a private message to each member in the channel, in the background
+    notifications.notify_new_poll(new_poll, command.channel)
 
-    config.session.commit()
+    # Only once the poll can be found by the other events, so that the votes of the first reactions are not ignored
+    await auxiliary.add_vote_reactions(msg, options)
 
     print('Poll %s created -> %s!' % (new_poll.poll_key, command.content))
 
 
+@monitoring.handler_durations.timed
+@profiling.query_budget(20)
 async def edit_poll_command(command, db_channel):
     """
     Edit a poll.
@@ -330,7 +344,7 @@ async def edit_poll_command(command, db_channel):
     poll_key = poll_params[0]
 
     # Select the current poll
-    poll = config.session.query(models.Poll).filter(models.Poll.poll_key == poll_key).first()
+    poll = await database.run(config.session.query(models.Poll).filter(models.Poll.poll_key == poll_key).first)
 
     # If no poll was found with that id
     if poll is None:
@@ -348,9 +362,11 @@ async def edit_poll_command(command, db_channel):
 
     edited = ''
 
+    # Whether the number of options changed, with the buttons that need to follow
+    buttons_changed = False
+
     # Get all options available in the poll
-    db_options = config.session.query(models.Option).filter(models.Option.poll_id == poll.id) \
-        .order_by(models.Option.position).all()
+    db_options = await database.run(auxiliary.get_options, poll.id)
 
     # Add the new options
     if add:
@@ -364,21 +380,24 @@ async def edit_poll_command(command, db_channel):
         for option in new_options:
             options.append(models.Option(poll.id, len(db_options) + len(options) + 1, option))
 
-        config.session.add_all(options)
+        await database.run(config.session.add_all, options)
 
-        # Get the message corresponding to the poll
-        c = config.client.get_channel(db_channel.discord_id)
-        discord_poll_msg = await c.fetch_message(poll.discord_message_id)
+        if config.VOTE_BUTTONS:
+            # The buttons are sent with the new content of the message
+            buttons_changed = True
+        else:
+            # Get the message corresponding to the poll
+            discord_poll_msg = auxiliary.get_message(db_channel.discord_id, poll.discord_message_id)
 
-        # Add a reaction for each new option
-        emoji = chr(ord(u'\u0031') + len(db_options))
+            # Add a reaction for each new option
+            emoji = chr(ord(u'\u0031') + len(db_options))
 
-        # Max number of reactions that can be added
-        num_react = min(9, len(db_options) + len(options))
+            # Max number of reactions that can be added
+            num_react = min(9, len(db_options) + len(options))
 
-        for i in range(max(0, num_react - len(db_options))):
-            await discord_poll_msg.add_reaction(emoji + u'\u20E3')
-            emoji = chr(ord(emoji) + 1)
+            for i in range(max(0, num_react - len(db_options))):
+                await discord_poll_msg.add_reaction(emoji + u'\u20E3')
+                emoji = chr(ord(emoji) + 1)
 
         db_options.extend(options)
     # Remove, lock or unlock options
@@ -397,29 +416,31 @@ async def edit_poll_command(command, db_channel):
             selected_options = list(set(selected_options))
 
             if remove:
-                options = config.session.query(models.Option) \
-                    .filter(models.Option.poll_id == poll.id) \
-                    .filter(models.Option.position.in_(selected_options)) \
-                    .all()
+                options = await database.run(config.session.query(models.Option)
+                                             .filter(models.Option.poll_id == poll.id)
+                                             .filter(models.Option.position.in_(selected_options))
+                                             .all)
 
                 num_reactions = max(10 - len(db_options) - len(options), 0)
 
-                edited = 'options removed %s' % options
+                edited = 'options removed %s' % [o.option_text for o in options]
 
                 for option in options:
-                    config.session.delete(option)
+                    await database.run(config.session.delete, option)
 
-                # Get the message corresponding to the poll
-                c = config.client.get_channel(db_channel.discord_id)
-                discord_poll_msg = await c.fetch_message(poll.discord_message_id)
+                db_options = await database.run(auxiliary.get_options, poll.id)
 
-                db_options = config.session.query(models.Option).filter(models.Option.poll_id == poll.id) \
-                    .order_by(models.Option.position).all()
+                if config.VOTE_BUTTONS:
+                    # The buttons are sent with the new content of the message
+                    buttons_changed = True
+                else:
+                    # Get the message corresponding to the poll
+                    discord_poll_msg = auxiliary.get_message(db_channel.discord_id, poll.discord_message_id)
 
-                for i in range(num_reactions):
-                    emoji = chr(ord(u'\u0031') + len(db_options) + i)
+                    for i in range(num_reactions):
+                        emoji = chr(ord(u'\u0031') + len(db_options) + i)
 
-                    await auxiliary.remove_reaction(discord_poll_msg, emoji)
+                        await auxiliary.remove_reaction(discord_poll_msg, emoji)
 
                 # Update the positions
                 pos = 1
@@ -464,20 +485,26 @@ async def edit_poll_command(command, db_channel):
                      % (multiple_options, only_numbers, new_options, allow_external)
 
     # Edit message
-    c = config.client.get_channel(db_channel.discord_id)
-
     try:
-        m = await c.fetch_message(poll.discord_message_id)
+        content = await database.run(auxiliary.create_message, poll, db_options)
 
-        await m.edit(content=auxiliary.create_message(poll, db_options))
+        if buttons_changed:
+            await auxiliary.edit_vote_buttons(db_channel.discord_id, poll.discord_message_id, db_options, content)
+        else:
+            await edits.edit_message(db_channel.discord_id, poll.discord_message_id, content)
     except discord.errors.NotFound:
-        config.session.delete(poll)
+        await database.run(config.session.delete, poll)
+
+    await database.run(config.session.commit)
 
-    config.session.commit()
+    # The poll has changed, only after the commit so that other events do not cache it again as it was
+    cache.polls.invalidate(poll.id)
 
     print('Poll %s was edited for %s -> %s!' % (poll.poll_key, edited, command.content))
 
 
+@monitoring.handler_durations.timed
+@profiling.query_budget(25)
 async def close_poll_command(command, db_channel):
     """
     Close a poll.
@@ -517,21 +544,23 @@ async def close_poll_command(command, db_channel):
             selected_options.append(int(o))
 
         # Select the current poll
-        poll = config.session.query(models.Poll).filter(models.Poll.poll_key == poll_key).first()
+        poll = await database.run(config.session.query(models.Poll).filter(models.Poll.poll_key == poll_key).first)
 
         # Edit the message with the poll
         if poll is not None:
             # Only the author can close the poll
             if poll.discord_author_id == command.author.id:
-                options = config.session.query(models.Option).filter(models.Option.poll_id == poll.id) \
-                    .order_by(models.Option.position).all()
+                options = await database.run(auxiliary.get_options, poll.id)
 
                 # Send a private message to all participants in the poll
                 await auxiliary.send_closed_poll_message(options, command.guild, poll, command.channel)
 
                 await auxiliary.close_poll(poll, db_channel, selected_options)
 
-                config.session.commit()
+                await database.run(config.session.commit)
+
+                # Only after the commit, so that other events do not cache it again as open
+                cache.polls.invalidate(poll.id)
 
                 print('Poll %s closed -> %s!' % (poll.poll_key, command.content))
         else:
@@ -542,6 +571,8 @@ async def close_poll_command(command, db_channel):
         pass
 
 
+@monitoring.handler_durations.timed
+@profiling.query_budget(20)
 async def delete_poll_command(command, db_channel):
     """
     Delete a poll.
@@ -570,13 +601,13 @@ async def delete_poll_command(command, db_channel):
     poll_key = params[1]
 
     # Select the current poll
-    poll = config.session.query(models.Poll).filter(models.Poll.poll_key == poll_key).first()
+    poll = await database.run(config.session.query(models.Poll).filter(models.Poll.poll_key == poll_key).first)
 
     # Delete the message with the poll
     if poll is not None:
         await auxiliary.delete_poll(poll, db_channel, command.author.id)
 
-        config.session.commit()
+        await database.run(config.session.commit)
 
         print('Poll %s deleted -> %s!' % (poll.poll_key, command.content))
     else:
@@ -585,6 +616,8 @@ async def delete_poll_command(command, db_channel):
         await auxiliary.send_temp_message(msg, command.channel)
 
 
+@monitoring.handler_durations.timed
+@profiling.query_budget(8)
 async def vote_poll_command(command, db_channel):
     """
     models.Vote a list of options in a poll.
@@ -623,7 +656,7 @@ async def vote_poll_command(command, db_channel):
     options = params[2]
 
     # Select the current poll
-    poll = config.session.query(models.Poll).filter(models.Poll.poll_key == poll_key).first()
+    poll = await database.run(config.session.query(models.Poll).filter(models.Poll.poll_key == poll_key).first)
 
     # If no poll was found with that id
     if poll is None:
@@ -633,8 +666,7 @@ async def vote_poll_command(command, db_channel):
         return
 
     # Get all options available in the poll
-    db_options = config.session.query(models.Option).filter(models.Option.poll_id == poll.id) \
-        .order_by(models.Option.position).all()
+    db_options = await database.run(auxiliary.get_options, poll.id)
 
     # If it is an vote for an external user and it is not allowed
     if author_id is None and not poll.allow_external:
@@ -645,6 +677,7 @@ async def vote_poll_command(command, db_channel):
         return
 
     poll_edited = False
+    option_added = False
 
     # Option is a list of numbers
     try:
@@ -654,14 +687,14 @@ async def vote_poll_command(command, db_channel):
         for o in options.split(','):
             selected_options.append(int(o))
 
-        for option in selected_options:
-            poll_edited |= auxiliary.add_vote(option, author_id, db_options, poll.multiple_options)
+        poll_edited = await database.run(auxiliary.apply_votes, selected_options, author_id, db_options,
+                                         poll.multiple_options)
 
     # Option is not a list of numbers
     except ValueError:
         if poll.new_options:
             if not poll.multiple_options:
-                auxiliary.remove_prev_vote(db_options, author_id)
+                await database.run(auxiliary.remove_prev_vote, db_options, author_id)
 
             if options[0] == '"' and options[-1] == '"':
                 # Remove quotation marks
@@ -669,10 +702,11 @@ async def vote_poll_command(command, db_channel):
 
                 # Add the new option to the poll
                 options = models.Option(poll.id, len(db_options) + 1, options)
+                options.num_votes = 1
                 db_options.append(options)
-                config.session.add(options)
+                await database.run(config.session.add, options)
 
-                config.session.flush()
+                await database.run(config.session.flush)
 
                 # Check the type of participant
                 # int means discord used
@@ -685,9 +719,10 @@ async def vote_poll_command(command, db_channel):
                     participant_name = None
 
                 vote = models.Vote(options.id, discord_participant_id, participant_name)
-                config.session.add(vote)
+                await database.run(config.session.add, vote)
 
                 poll_edited = True
+                option_added = True
         else:
             msg = 'models.Poll *%s* does not allow for new votes.\n' \
                   'If you need this option, ask the poll author to edit it.' % poll_key
@@ -695,21 +730,28 @@ async def vote_poll_command(command, db_channel):
             await auxiliary.send_temp_message(msg, command.channel)
             return
 
-    # Edit the message
-    if poll_edited:
-        c = config.client.get_channel(db_channel.discord_id)
+    await database.run(config.session.commit)
 
-        try:
-            m = await c.fetch_message(poll.discord_message_id)
-            await m.edit(content=auxiliary.create_message(poll, db_options))
-        except discord.errors.NotFound:
-            config.session.delete(poll)
+    # The poll got a new option, only after the commit so that other events do not cache it again without it
+    if option_added:
+        cache.polls.invalidate(poll.id)
 
-    config.session.commit()
+        # Add a button for the new option
+        if config.VOTE_BUTTONS:
+            try:
+                await auxiliary.edit_vote_buttons(db_channel.discord_id, poll.discord_message_id, db_options)
+            except discord.errors.NotFound:
+                pass
+
+    # Edit the message, together with the other votes that arrive shortly after
+    if poll_edited:
+        edits.scheduler.schedule(poll.id, db_channel.discord_id)
 
     print('%s voted in %s -> %s!' % (author_id, poll.poll_key, command.content))
 
 
+@monitoring.handler_durations.timed
+@profiling.query_budget(6)
 async def unvote_poll_command(command, db_channel):
     """
     Remove a vote from an option in a poll.
@@ -748,7 +790,7 @@ async def unvote_poll_command(command, db_channel):
     options = params[2]
 
     # Select the current poll
-    poll = config.session.query(models.Poll).filter(models.Poll.poll_key == poll_key).first()
+    poll = await database.run(config.session.query(models.Poll).filter(models.Poll.poll_key == poll_key).first)
 
     # If no poll was found with that id
     if poll is None:
@@ -758,8 +800,7 @@ async def unvote_poll_command(command, db_channel):
         return
 
     # Get all options available in the poll
-    db_options = config.session.query(models.Option).filter(models.Option.poll_id == poll.id) \
-        .order_by(models.Option.position).all()
+    db_options = await database.run(auxiliary.get_options, poll.id)
 
     poll_edited = False
 
@@ -771,21 +812,14 @@ async def unvote_poll_command(command, db_channel):
         for o in options.split(','):
             selected_options.append(int(o))
 
-        for option in selected_options:
-            poll_edited |= auxiliary.remove_vote(option, author_id, db_options)
+        poll_edited = await database.run(auxiliary.apply_votes, selected_options, author_id, db_options,
+                                         poll.multiple_options, unvote=True)
 
         if poll_edited:
-            # Edit the message
-            c = config.client.get_channel(db_channel.discord_id)
-
-            try:
-                m = await c.fetch_message(poll.discord_message_id)
+            await database.run(config.session.commit)
 
-                await m.edit(content=auxiliary.create_message(poll, db_options))
-            except discord.errors.NotFound:
-                config.session.delete(poll)
-
-            config.session.commit()
+            # Edit the message, together with the other votes that arrive shortly after
+            edits.scheduler.schedule(poll.id, db_channel.discord_id)
 
             print('%s removed vote from %s -> %s!' % (author_id, poll.poll_key, command.content))
 
@@ -794,6 +828,8 @@ async def unvote_poll_command(command, db_channel):
         pass
 
 
+@monitoring.handler_durations.timed
+@profiling.query_budget(6)
 async def refresh_poll_command(command, db_channel):
     """
     Show a pole in a new message.
@@ -822,16 +858,21 @@ async def refresh_poll_command(command, db_channel):
     poll_key = params[1]
 
     # Select the current poll
-    poll = config.session.query(models.Poll).filter(models.Poll.poll_key == poll_key).first()
+    poll = await database.run(config.session.query(models.Poll).filter(models.Poll.poll_key == poll_key).first)
 
     # Create the message with the poll
     # and delete the previous message
     if poll is not None:
+        # The edits requested until now would go to the message being deleted
+        edits.scheduler.cancel(poll.id)
+
         await auxiliary.refresh_poll(poll, db_channel.discord_id)
 
         print('Poll %s refreshed -> %s!' % (poll.poll_key, command.content))
 
 
+@monitoring.handler_durations.timed
+@profiling.query_budget(5)
 async def poll_mention_message_command(command, db_channel):
     """
     Create a message mentioning the voters of a given option.
@@ -842,7 +883,7 @@ async def poll_mention_message_command(command, db_channel):
 
     # If the channel does not exist in the DB
     if db_channel is None:
-        auxiliary.create_channel(command)
+        await database.run(auxiliary.create_channel, command)
 
     # Get the list of parameters in the message
     params = auxiliary.parse_command_parameters(command.content)
@@ -861,11 +902,13 @@ async def poll_mention_message_command(command, db_channel):
         poll_option = int(params[2])
 
         # Select the current poll
-        poll = config.session.query(models.Poll).filter(models.Poll.poll_key == poll_key,
-                                                        models.Poll.discord_server_id == command.guild.id).first()
+        poll = await database.run(config.session.query(models.Poll)
+                                  .filter(models.Poll.poll_key == poll_key,
+                                          models.Poll.discord_server_id == command.guild.id).first)
 
         if poll is not None:
-            msg = auxiliary.create_poll_mention_message(poll_option, message, poll.id, command.author.id)
+            msg = await database.run(auxiliary.create_poll_mention_message, poll_option, message, poll.id,
+                                     command.author.id)
 
             if msg is not None:
                 await command.channel.send(msg)
@@ -877,6 +920,8 @@ async def poll_mention_message_command(command, db_channel):
         pass
 
 
+@monitoring.handler_durations.timed
+@profiling.query_budget(3)
 async def help_message_command(command, db_channel):
     """
     Show a help message with the available commands.
@@ -887,7 +932,7 @@ async def help_message_command(command, db_channel):
 
     # Create channel if it doesn't already exist
     if db_channel is None:
-        auxiliary.create_channel(command)
+        await database.run(auxiliary.create_channel, command)
 
     msg = 'Poll Me Bot Help\n' \
           '----------------\n' \
@@ -900,6 +945,8 @@ async def help_message_command(command, db_channel):
     await auxiliary.send_temp_message(msg, command.channel)
 
 
+@monitoring.handler_durations.timed
+@profiling.query_budget(3)
 async def start_interactive_command(command: discord.message.Message, db_channel):
     """
     Show a help message with the available commands.
@@ -910,11 +957,18 @@ async def start_interactive_command(command: discord.message.Message, db_channel
 
     # Create channel if it doesn't already exist
     if db_channel is None:
-        auxiliary.create_channel(command)
+        await database.run(auxiliary.create_channel, command)
 
     msg = interactive.header % 'menu'
 
     for i in range(len(interactive.menu_options)):
         msg += '\n' + str(i + 1) + ' - ' + interactive.menu_options[i]
 
-    await auxiliary.show_interactive_message(msg, command.channel, interactive.menu_options)
+    # Registered before the reactions are added, so that the members reacting right away are not ignored
+    msg = await interactive.send_interactive_message(msg, command.channel)
+
+    try:
+        await auxiliary.add_options_reactions(msg, interactive.menu_options)
+    except discord.errors.NotFound:
+        # An option was already chosen, which deletes the menu
+        pass
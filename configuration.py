@@ -1,15 +1,15 @@
+import contextvars
 import os
-import discord
+import time
 
-import alembic.config as aleconf
-import alembic.command as alecomm
-import alembic.migration as alemig
-import alembic.autogenerate as aleauto
+import discord
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
 
-import models
+import pool
+import schema
 
 
 # region Configuration
@@ -17,12 +17,72 @@ import models
 # Time between checks
 TIME_BETWEEN_CHECKS_SEC = 43200
 
+# Time between audits of all messages and channels, deletions are handled as they happen
+TIME_BETWEEN_AUDITS_SEC = 604800
+
 # Time after which a closed poll is deleted
 OLDEST_CLOSED_POLL_DAYS = 10
 
+# Maximum number of messages being deleted at the same time by maintenance jobs
+CONCURRENT_MESSAGE_DELETIONS = 4
+
+# Maximum number of private messages being sent at the same time
+CONCURRENT_NOTIFICATIONS = 2
+
+# Time each sender waits between private messages
+NOTIFICATION_INTERVAL_SEC = 0.5
+
+# Time without private messages after being rate limited
+NOTIFICATION_RATE_LIMIT_PAUSE_SEC = 60
+
 # Limit number of polls per server
 POLL_LIMIT_SERVER = 15
 
+# Number of threads doing DB work, each event uses its own session
+DB_THREADS = 5
+
+# Number of connections kept open to the DB
+DB_POOL_SIZE = 5
+
+# Number of connections opened above the size of the pool when all are in use, closed once returned
+DB_MAX_OVERFLOW = 5
+
+# Time waiting for a connection from the pool before failing
+DB_POOL_TIMEOUT_SEC = 30
+
+# Test the connections when taken from the pool, replacing those that were closed by the DB
+DB_POOL_PRE_PING = True
+
+# Maximum number of polls kept in memory
+POLL_CACHE_SIZE = 1000
+
+# Time after which a poll that received no votes is removed from memory
+POLL_CACHE_IDLE_SEC = 3600
+
+# Maximum number of rendered messages of polls kept in memory
+RENDER_CACHE_SIZE = 1000
+
+# Maximum number of channel settings kept in memory
+CHANNEL_CACHE_SIZE = 10000
+
+# Time without new votes after which the message of a poll is edited
+EDIT_DELAY_SEC = 1
+
+# Maximum time between a vote and the edit of the message of the poll
+EDIT_MAX_DELAY_SEC = 3
+
+# Maximum length of a message in Discord, longer polls show only part of the voters
+MESSAGE_MAX_LENGTH = 2000
+
+# Send the complete results of a closed poll as a file, when they do not fit in the message
+CLOSED_POLL_RESULTS_FILE = True
+
+# Address of the server of the metrics, local only
+METRICS_HOST = '127.0.0.1'
+
+# Vote with buttons, sent with the message of the poll in a single request, instead of reactions added one by one
+VOTE_BUTTONS = False
+
 # endregion
 
 
@@ -42,41 +102,89 @@ if token is None:
     print('Unable to find bot token!')
     exit(1)
 
-engine = create_engine(database_url)
-Session = sessionmaker(bind=engine)
+if make_url(database_url).get_backend_name() == 'sqlite':
+    # SQLite is only used by the benchmarks, its writes lock the whole DB, so each statement is committed on its own,
+    # keeping the locks short enough for the sessions using the other connections to wait
+    engine = create_engine(database_url, poolclass=pool.TimedQueuePool, pool_size=DB_POOL_SIZE,
+                           max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT_SEC,
+                           connect_args={'check_same_thread': False, 'isolation_level': None, 'timeout': 30})
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        # The readers do not wait for the writers and the commits, one for each statement, are not synced to disk
+        dbapi_connection.execute('PRAGMA journal_mode=WAL')
+        dbapi_connection.execute('PRAGMA synchronous=OFF')
+else:
+    engine = create_engine(database_url, poolclass=pool.TimedQueuePool, pool_size=DB_POOL_SIZE,
+                           max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT_SEC,
+                           pool_pre_ping=DB_POOL_PRE_PING)
+
+# Objects are not expired on commit, so that reading them outside of the DB threads does not query the DB
+Session = sessionmaker(bind=engine, expire_on_commit=False)
+
+# Duration of each step of the startup, in seconds
+startup_times = {}
+
+start = time.perf_counter()
+connection = engine.connect()
+startup_times['DB connect'] = time.perf_counter() - start
+
+# Makes sure the database is up to date, the migrations are applied by migrate.py
+start = time.perf_counter()
+
+if not schema.check(connection, schema.get_alembic_config(database_url)):
+    print('The database is not up to date, run migrate.py!')
+    exit(1)
+
+connection.close()
+startup_times['Schema check'] = time.perf_counter() - start
+
+# The unit of work running, set for each event by database.unit_of_work
+session_scope = contextvars.ContextVar('session_scope', default=None)
+
+# Session of the unit of work running, created on first use
+session = scoped_session(Session, scopefunc=session_scope.get)
+
+# endregion
+
+
+# region Sharding
+
+# Number of shards, 'auto' to use the number recommended by Discord, or none to run without shards
+shard_count = os.environ.get('SHARD_COUNT', None)
+
+# Shards run by this process, such as 0-3 or 0,2,4, or none to run all shards
+shard_ids = os.environ.get('SHARD_IDS', None)
 
-MIGRATIONS_DIR = './migrations/'
+if shard_ids is not None:
+    if shard_count is None or shard_count == 'auto':
+        print('The number of shards is needed when running only some shards!')
+        exit(1)
 
-config = aleconf.Config(file_='%salembic.ini' % MIGRATIONS_DIR)
-config.set_main_option('script_location', MIGRATIONS_DIR)
-config.set_main_option('sqlalchemy.url', database_url)
+    ids = []
 
-# Create tables if they don't exist
-if not os.path.isdir(MIGRATIONS_DIR):
-    alecomm.init(config, MIGRATIONS_DIR)
+    for shard_range in shard_ids.split(','):
+        limits = shard_range.split('-')
+        ids.extend(range(int(limits[0]), int(limits[-1]) + 1))
+
+    shard_ids = ids
+
+if shard_count is not None and shard_count != 'auto':
+    shard_count = int(shard_count)
+
+# endregion
 
-    env_file = open('%senv.py' % MIGRATIONS_DIR, 'r+')
-    text = env_file.read()
-    text = text.replace('target_metadata=target_metadata', 'target_metadata=target_metadata, compare_type=True')
-    text = text.replace('target_metadata = None', 'import models\ntarget_metadata = models.base.metadata')
-    env_file.seek(0)
-    env_file.write(text)
-    env_file.close()
 
-# Makes sure the database is up to date
-alecomm.upgrade(config, 'head')
+# region Metrics
 
-# Check for changes in the database
-mc = alemig.MigrationContext.configure(engine.connect())
-diff_list = aleauto.compare_metadata(mc, models.base.metadata)
+# Port of the server of the metrics, which is only started when it is defined
+metrics_port = os.environ.get('METRICS_PORT', None)
 
-# Update the database
-if diff_list:
-    alecomm.revision(config, None, autogenerate=True)
-    alecomm.upgrade(config, 'head')
+if metrics_port is not None:
+    metrics_port = int(metrics_port)
 
-# New Session
-session = Session()
+# Fail the events that make more queries to the DB than their budget, to find regressions while testing
+strict_query_budgets = os.environ.get('STRICT_QUERY_BUDGETS', None) == '1'
 
 # endregion
 
@@ -85,4 +193,9 @@ session = Session()
 intents = discord.Intents.default()
 intents.members = True
 
-client = discord.Client(intents=intents)
+if shard_count == 'auto':
+    client = discord.AutoShardedClient(intents=intents)
+elif shard_count is not None:
+    client = discord.AutoShardedClient(intents=intents, shard_count=shard_count, shard_ids=shard_ids)
+else:
+    client = discord.Client(intents=intents)
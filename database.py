@@ -0,0 +1,81 @@
+import asyncio
+import contextvars
+import functools
+import itertools
+
+from concurrent.futures import ThreadPoolExecutor
+
+import configuration as config
+
+# All the DB work is done in these threads, so that a slow query never blocks the event loop
+executor = ThreadPoolExecutor(max_workers=config.DB_THREADS, thread_name_prefix='db')
+
+# Identifiers of the units of work
+unit_ids = itertools.count()
+
+# Units of work using a connection, no more than the pool has, so that the DB threads never wait for one while the
+# units holding the connections wait for a thread, created in the loop of the client
+connection_slots = None
+
+# Whether the unit of work running holds one of the slots
+holds_slot = contextvars.ContextVar('holds_slot', default=None)
+
+
+async def run(func, *args, **kwargs):
+    """
+    Run a function that uses the DB in the executor, waiting for it without blocking the event loop.
+
+    :param func: the function to run, usually a query method or one of the synchronous functions in auxiliary.
+    :param args: the positional arguments of the function.
+    :param kwargs: the keyword arguments of the function.
+    :return: the result of the function.
+    """
+
+    global connection_slots
+
+    loop = asyncio.get_running_loop()
+
+    # The first use of the DB by a unit of work waits for a connection here, without taking a thread
+    held = holds_slot.get()
+
+    if held is not None and not held[0]:
+        if connection_slots is None:
+            connection_slots = asyncio.Semaphore(config.DB_POOL_SIZE + config.DB_MAX_OVERFLOW)
+
+        await connection_slots.acquire()
+        held[0] = True
+
+    # Keep the context of the event that called it
+    context = contextvars.copy_context()
+
+    return await loop.run_in_executor(executor, functools.partial(context.run, func, *args, **kwargs))
+
+
+def unit_of_work(handler):
+    """
+    Decorate a coroutine function, such as the handler of an event, so that it uses its own session.
+    The session is closed at the end, rolling back what was not committed and releasing its objects and connection.
+
+    :param handler: the coroutine function.
+    :return: the decorated function.
+    """
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        token = config.session_scope.set(next(unit_ids))
+        held = [False]
+        slot_token = holds_slot.set(held)
+
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            if config.session.registry.has():
+                await run(config.session.remove)
+
+            if held[0]:
+                connection_slots.release()
+
+            holds_slot.reset(slot_token)
+            config.session_scope.reset(token)
+
+    return wrapper
@@ -0,0 +1,168 @@
+import asyncio
+
+import discord
+
+import auxiliary
+import cache
+import configuration as config
+import database
+import metrics
+
+edits_requested = metrics.Counter('poll_edits_requested', 'Number of times the message of a poll needed an edit.')
+edits_done = metrics.Counter('poll_edits_done', 'Number of edits sent to Discord for the messages of polls.')
+edits_saved = metrics.Counter('poll_edits_saved', 'Number of edits that were merged into another edit.')
+edits_suppressed = metrics.Counter('poll_edits_suppressed',
+                                   'Number of edits skipped because the message already showed the same content.')
+renders_reused = metrics.Counter('poll_renders_reused',
+                                 'Number of times the message of a poll was reused because the poll had not changed.')
+
+
+class PendingEdit:
+    """Edit waiting to be done to the message of a poll."""
+
+    def __init__(self, channel_discord_id, now):
+        self.channel_discord_id = channel_discord_id
+
+        # Requests since the last edit
+        self.requests = 0
+        self.first_request = now
+        self.last_request = now
+
+        self.task = None
+
+
+class EditScheduler:
+    """
+    Merges the edits to the message of a poll that are requested within a short time of each other into a single
+    edit, with the latest content of the poll.
+    """
+
+    def __init__(self, delay_sec, max_delay_sec):
+        """
+        :param delay_sec: the time without new requests after which the edit is done.
+        :param max_delay_sec: the maximum time between a request and the edit.
+        """
+
+        self.delay_sec = delay_sec
+        self.max_delay_sec = max_delay_sec
+
+        self.pending = {}
+
+    def schedule(self, poll_id, channel_discord_id):
+        """
+        Request an edit to the message of a poll.
+
+        :param poll_id: the id of the poll in the DB.
+        :param channel_discord_id: the id of the discord channel.
+        """
+
+        edits_requested.inc()
+
+        now = asyncio.get_running_loop().time()
+
+        pending = self.pending.get(poll_id)
+
+        if pending is None:
+            pending = PendingEdit(channel_discord_id, now)
+            self.pending[poll_id] = pending
+
+            pending.task = asyncio.create_task(self.run(poll_id, pending))
+        elif pending.requests == 0:
+            pending.first_request = now
+
+        pending.requests += 1
+        pending.last_request = now
+
+    def cancel(self, poll_id):
+        """
+        Drop the edits requested for a poll that have not started yet, because its message is being replaced.
+
+        :param poll_id: the id of the poll in the DB.
+        """
+
+        pending = self.pending.get(poll_id)
+
+        if pending is not None:
+            pending.requests = 0
+
+    async def run(self, poll_id, pending):
+        """
+        Edit the message of a poll once the requests stop or the maximum delay is reached, until there are no more
+        requests.
+
+        :param poll_id: the id of the poll in the DB.
+        :param pending: the PendingEdit of the poll.
+        """
+
+        loop = asyncio.get_running_loop()
+
+        try:
+            while pending.requests > 0:
+                wait = min(pending.last_request + self.delay_sec,
+                           pending.first_request + self.max_delay_sec) - loop.time()
+
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+
+                edits_saved.inc(pending.requests - 1)
+                pending.requests = 0
+
+                await edit_poll_message(poll_id, pending.channel_discord_id)
+        finally:
+            del self.pending[poll_id]
+
+
+@database.unit_of_work
+async def edit_poll_message(poll_id, channel_discord_id):
+    """
+    Edit the current message of a poll with its current content.
+
+    :param poll_id: the id of the poll in the DB.
+    :param channel_discord_id: the id of the discord channel.
+    """
+
+    rendered = cache.renders.get(poll_id)
+
+    if rendered is not None:
+        renders_reused.inc()
+    else:
+        version = cache.renders.version(poll_id)
+        rendered = await database.run(auxiliary.render_poll, poll_id)
+
+        # The poll no longer exists
+        if rendered is None:
+            return
+
+        cache.renders.put(poll_id, version, rendered)
+
+    content, discord_message_id = rendered
+
+    try:
+        await edit_message(channel_discord_id, discord_message_id, content)
+    except discord.errors.NotFound:
+        await database.run(auxiliary.delete_poll_by_message, poll_id, discord_message_id)
+        await database.run(config.session.commit)
+
+
+# Scheduler for the edits caused by votes
+scheduler = EditScheduler(config.EDIT_DELAY_SEC, config.EDIT_MAX_DELAY_SEC)
+
+
+async def edit_message(channel_discord_id, discord_message_id, content):
+    """
+    Edit the message of a poll, unless it already shows the same content.
+
+    :param channel_discord_id: the id of the discord channel.
+    :param discord_message_id: the id of the message of the poll.
+    :param content: the new content of the message.
+    """
+
+    if cache.renders.is_shown(discord_message_id, content):
+        edits_suppressed.inc()
+        return
+
+    await auxiliary.get_message(channel_discord_id, discord_message_id).edit(content=content)
+    cache.renders.set_shown(discord_message_id, content)
+
+    edits_done.inc()
@@ -2,13 +2,16 @@ import asyncio
 import datetime
 import random
 import re
+import time
 from typing import List
 
-import discord.reaction
+import discord
 
 import auxiliary
+import cache
 import commands
 import configuration as config
+import database
 import models
 
 header = 'Poll Me Bot Interactive mode (in Beta) (key:%s)\n' \
@@ -16,35 +19,95 @@ header = 'Poll Me Bot Interactive mode (in Beta) (key:%s)\n' \
 
 menu_options = ['Create a poll.', 'Check help menu.']
 
+# The interactive messages sent by the bot, by id, with the time at which they expire
+interactive_messages = {}
 
-async def process_reaction(reaction: discord.reaction.Reaction):
+
+def register_message(message: discord.message.Message, time_sec=300):
+    """
+    Register one of the bot's interactive messages, so that interactions with it are processed.
+
+    :param message: the message.
+    :param time_sec: the time during which the message accepts interactions, in seconds.
+    """
+
+    now = time.monotonic()
+
+    # Forget the messages that have expired
+    for message_id in [m for m, (expiry, _) in interactive_messages.items() if expiry <= now]:
+        del interactive_messages[message_id]
+
+    interactive_messages[message.id] = (now + time_sec, message)
+
+
+def get_interactive_message(message_id):
+    """
+    Get one of the bot's interactive messages, without a request to Discord.
+
+    :param message_id: the id of the message.
+    :return: the message or None, if it is not an interactive message or it has expired.
+    """
+
+    expiry, message = interactive_messages.get(message_id, (0, None))
+
+    if expiry <= time.monotonic():
+        return None
+
+    return message
+
+
+def is_interactive_message(message_id):
+    """
+    Check if a message is one of the bot's interactive messages, without a request to Discord.
+
+    :param message_id: the id of the message.
+    :return: True if it is an interactive message that has not expired.
+    """
+
+    return get_interactive_message(message_id) is not None
+
+
+async def send_interactive_message(message, channel, time_sec=300):
+    """
+    Send a temporary interactive message.
+
+    :param message: the message sent.
+    :param channel: the Discord channel.
+    :param time_sec: the time before deleting the temporary message, in seconds.
+    :return: the message.
+    """
+
+    msg = await channel.send(message, delete_after=time_sec)
+
+    register_message(msg, time_sec)
+
+    return msg
+
+
+async def process_reaction(emoji: str, referenced_message: discord.message.Message):
     """
     Process a reaction to one of the bot's messages.
 
-    :param reaction: the reaction.
+    :param emoji: the emoji of the reaction.
+    :param referenced_message: the message that got the reaction.
     """
 
     # Get the number of the vote
-    option = ord(reaction.emoji[0]) - 49
-
-    # Get the referenced message
-    c = config.client.get_channel(reaction.message.channel.id)
-    referenced_message = await c.fetch_message(reaction.message.id)
+    option = ord(emoji[0]) - 49
 
-    if 'key:menu' in reaction.message.content:
+    if 'key:menu' in referenced_message.content:
         if option == 0:
             msg = header % 'create_poll' + '\nReply to this message with the title of the poll.'
-            task = asyncio.create_task(auxiliary.send_temp_message(msg, reaction.message.channel, time=300))
+            task = asyncio.create_task(send_interactive_message(msg, referenced_message.channel))
         elif option == 1:
             # Get the channel information from the DB
-            db_channel = config.session.query(models.Channel) \
-                .filter(models.Channel.discord_id == reaction.message.channel.id).first()
+            db_channel = await database.run(auxiliary.get_channel, referenced_message.channel.id)
 
-            task = asyncio.create_task(commands.help_message_command(reaction.message, db_channel))
+            task = asyncio.create_task(commands.help_message_command(referenced_message, db_channel))
         else:
             return
 
-    elif 'key:add_options' in reaction.message.content:
+    elif 'key:add_options' in referenced_message.content:
         if option == 128149:
             # Get the current dates
             start_date = datetime.datetime.today()
@@ -106,28 +169,22 @@ async def create_poll(reply: discord.message.Message, db_channel: models.Channel
     new_poll = models.Poll(poll_key, reply.author.id, reply.content, False,
                            False, False, False, db_channel.id, reply.guild.id)
 
-    config.session.add(new_poll)
-    config.session.commit()
+    await database.run(config.session.add, new_poll)
+    await database.run(config.session.commit)
 
     # Send the message
     msg = header % ('add_options)(poll_key:%s)' % poll_key) \
           + '\nReply to this message with the options of the poll, separated by comma (,).\n' \
             'Or use the 📆 reaction to add weekdays as options.'
 
-    message = await reply.channel.send(msg)
+    # Deleted after 300 seconds in the background, instead of holding the event and its connection until then
+    message = await reply.channel.send(msg, delete_after=300)
+
+    register_message(message)
 
     # Add the calendar reaction
     await message.add_reaction('📆')
 
-    # Wait for 300 seconds
-    await asyncio.sleep(300)
-
-    # Delete this message
-    try:
-        await message.delete()
-    except discord.errors.NotFound:
-        pass
-
 
 async def add_options(options: List[str], referenced_message: discord.message.Message):
     """
@@ -141,7 +198,8 @@ async def add_options(options: List[str], referenced_message: discord.message.Me
     poll_key = re.search(r'poll_key:([^)]+)', referenced_message.content).group(1)
 
     # Get the poll with this key
-    db_poll: models.Poll = config.session.query(models.Poll).filter(models.Poll.poll_key == poll_key).first()
+    db_poll: models.Poll = await database.run(
+        config.session.query(models.Poll).filter(models.Poll.poll_key == poll_key).first)
 
     # Create the DB options
     db_options = []
@@ -149,16 +207,19 @@ async def add_options(options: List[str], referenced_message: discord.message.Me
     for i in range(len(options)):
         db_options.append(models.Option(db_poll.id, len(db_options) + 1, options[i].strip()))
 
-    config.session.add_all(db_options)
+    await database.run(config.session.add_all, db_options)
 
     # Create the message with the poll
-    msg = await referenced_message.channel.send(auxiliary.create_message(db_poll, db_options))
+    msg = await auxiliary.send_poll_message(referenced_message.channel,
+                                            await database.run(auxiliary.create_message, db_poll, db_options),
+                                            options)
 
     db_poll.discord_message_id = msg.id
+    cache.poll_messages.add(msg.id, db_poll.id)
 
-    # Add a reaction for each option
-    await auxiliary.add_options_reactions(msg, options)
+    await database.run(config.session.commit)
 
-    config.session.commit()
+    # Only once the poll can be found by the other events, so that the votes of the first reactions are not ignored
+    await auxiliary.add_vote_reactions(msg, options)
 
     print('Poll %s created -> %s!' % (db_poll.poll_key, db_poll.question))
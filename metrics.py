@@ -0,0 +1,179 @@
+import contextlib
+import functools
+import threading
+import time
+
+# All the counters, by name
+counters = {}
+
+# All the gauges, by name
+gauges = {}
+
+# All the histograms, by name
+histograms = {}
+
+# Upper bounds of the buckets of the histograms, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Counter:
+    """A value that only goes up, counting the occurrences of something."""
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+
+        self.lock = threading.Lock()
+
+        counters[name] = self
+
+    def inc(self, amount=1):
+        """
+        Increase the counter.
+
+        :param amount: the amount to add.
+        """
+
+        with self.lock:
+            self.value += amount
+
+
+class Gauge:
+    """A value that goes up and down, read when needed."""
+
+    def __init__(self, name, description, func):
+        """
+        :param name: the name of the gauge.
+        :param description: the description of the gauge.
+        :param func: the function that returns the current value.
+        """
+
+        self.name = name
+        self.description = description
+        self.func = func
+
+        gauges[name] = self
+
+    @property
+    def value(self):
+        return self.func()
+
+
+class Histogram:
+    """The distribution of a value, such as a duration, in buckets, for each value of a label."""
+
+    def __init__(self, name, description, label, buckets=DEFAULT_BUCKETS):
+        """
+        :param name: the name of the histogram.
+        :param description: the description of the histogram.
+        :param label: the name of the label that separates the observations.
+        :param buckets: the upper bounds of the buckets, in increasing order.
+        """
+
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = buckets
+
+        # The count of each bucket, the sum and the count of the observations, by value of the label
+        self.values = {}
+
+        self.lock = threading.Lock()
+
+        histograms[name] = self
+
+    def observe(self, label_value, value):
+        """
+        Add an observation.
+
+        :param label_value: the value of the label.
+        :param value: the value observed.
+        """
+
+        with self.lock:
+            counts, total, count = self.values.get(label_value, ([0] * len(self.buckets), 0, 0))
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+
+            self.values[label_value] = (counts, total + value, count + 1)
+
+    @contextlib.contextmanager
+    def time(self, label_value):
+        """
+        Observe the duration of a block of code, in seconds.
+
+        :param label_value: the value of the label.
+        """
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(label_value, time.perf_counter() - start)
+
+    def timed(self, func):
+        """
+        Decorate a coroutine function to observe the duration of each call, with its name as the value of the label.
+
+        :param func: the coroutine function.
+        :return: the decorated function.
+        """
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with self.time(func.__name__):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+
+def escape(text):
+    """Escape a text for the OpenMetrics format."""
+
+    return text.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render():
+    """
+    Write all the metrics in the OpenMetrics text format.
+
+    :return: the text.
+    """
+
+    lines = []
+
+    for counter in list(counters.values()):
+        lines.append('# TYPE %s counter' % counter.name)
+        lines.append('# HELP %s %s' % (counter.name, escape(counter.description)))
+        lines.append('%s_total %s' % (counter.name, counter.value))
+
+    for gauge in list(gauges.values()):
+        lines.append('# TYPE %s gauge' % gauge.name)
+        lines.append('# HELP %s %s' % (gauge.name, escape(gauge.description)))
+        lines.append('%s %s' % (gauge.name, gauge.value))
+
+    for histogram in list(histograms.values()):
+        lines.append('# TYPE %s histogram' % histogram.name)
+        lines.append('# HELP %s %s' % (histogram.name, escape(histogram.description)))
+
+        with histogram.lock:
+            values = [(label_value, list(counts), total, count)
+                      for label_value, (counts, total, count) in histogram.values.items()]
+
+        for label_value, counts, total, count in values:
+            label = '%s="%s"' % (histogram.label, escape(str(label_value)))
+
+            for bound, bucket_count in zip(histogram.buckets, counts):
+                lines.append('%s_bucket{%s,le="%s"} %d' % (histogram.name, label, bound, bucket_count))
+
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (histogram.name, label, count))
+            lines.append('%s_count{%s} %d' % (histogram.name, label, count))
+            lines.append('%s_sum{%s} %s' % (histogram.name, label, total))
+
+    lines.append('# EOF')
+
+    return '\n'.join(lines) + '\n'
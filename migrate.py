@@ -0,0 +1,46 @@
+import argparse
+import os
+
+import alembic.autogenerate as aleauto
+import alembic.command as alecomm
+import alembic.migration as alemig
+
+from sqlalchemy import create_engine
+
+import models
+import schema
+
+# Updates the database to the latest version, this needs to run before the bot is started after an update
+# It only applies the migrations in the repository, creating new ones is left for developers with --autogenerate
+
+parser = argparse.ArgumentParser(description='Update the database to the latest migration.')
+parser.add_argument('--autogenerate', nargs='?', const='', metavar='MESSAGE',
+                    help='also write a new migration with the changes to the models, after updating')
+args = parser.parse_args()
+
+# Get the database url saved in the environment variable
+database_url = os.environ.get('DATABASE_URL', None)
+
+if database_url is None:
+    print('Unable to find database url!')
+    exit(1)
+
+engine = create_engine(database_url)
+
+config = schema.get_alembic_config(database_url)
+
+# Makes sure the database is up to date
+alecomm.upgrade(config, 'head')
+
+if args.autogenerate is not None:
+    # Check for changes in the database
+    with engine.connect() as connection:
+        mc = alemig.MigrationContext.configure(connection)
+        diff_list = aleauto.compare_metadata(mc, models.base.metadata)
+
+    # Write a migration with the changes and update the database
+    if diff_list:
+        alecomm.revision(config, args.autogenerate or None, autogenerate=True)
+        alecomm.upgrade(config, 'head')
+
+print('The database is up to date!')
@@ -0,0 +1,32 @@
+"""Add indexes for lookups
+
+Revision ID: b4e2d7a91c3f
+Revises: 47b96d372f02
+Create Date: 2026-10-17 10:12:31.408213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4e2d7a91c3f'
+down_revision = '47b96d372f02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('poll_server_author', 'Poll', ['discord_server_id', 'discord_author_id'])
+    op.create_index('poll_channel', 'Poll', ['channel_id'])
+    op.create_index('option_poll_position', 'Option', ['poll_id', 'position'])
+    op.create_index('vote_option_discord_participant', 'Vote', ['option_id', 'discord_participant_id'])
+    op.create_index('vote_option_participant_name', 'Vote', ['option_id', 'participant_name'])
+
+
+def downgrade():
+    op.drop_index('vote_option_participant_name', table_name='Vote')
+    op.drop_index('vote_option_discord_participant', table_name='Vote')
+    op.drop_index('option_poll_position', table_name='Option')
+    op.drop_index('poll_channel', table_name='Poll')
+    op.drop_index('poll_server_author', table_name='Poll')
@@ -0,0 +1,24 @@
+"""Add index for closed date
+
+Revision ID: d81c5a0f6e29
+Revises: b4e2d7a91c3f
+Create Date: 2026-10-17 11:03:54.172630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81c5a0f6e29'
+down_revision = 'b4e2d7a91c3f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('poll_closed_date', 'Poll', ['closed_date'])
+
+
+def downgrade():
+    op.drop_index('poll_closed_date', table_name='Poll')
@@ -0,0 +1,37 @@
+"""Add unique constraints for votes
+
+Revision ID: e5f0a3c27b14
+Revises: d81c5a0f6e29
+Create Date: 2026-10-17 14:26:08.519347
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5f0a3c27b14'
+down_revision = 'd81c5a0f6e29'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep only the first of the repeated votes
+    op.execute('DELETE FROM "Vote" WHERE id NOT IN '
+               '(SELECT MIN(id) FROM "Vote" GROUP BY option_id, discord_participant_id, participant_name)')
+
+    # The constraints replace the indexes, in batch mode as SQLite can only add constraints by copying the table
+    with op.batch_alter_table('Vote') as batch_op:
+        batch_op.drop_index('vote_option_participant_name')
+        batch_op.drop_index('vote_option_discord_participant')
+        batch_op.create_unique_constraint('vote_option_discord_participant', ['option_id', 'discord_participant_id'])
+        batch_op.create_unique_constraint('vote_option_participant_name', ['option_id', 'participant_name'])
+
+
+def downgrade():
+    with op.batch_alter_table('Vote') as batch_op:
+        batch_op.drop_constraint('vote_option_participant_name', type_='unique')
+        batch_op.drop_constraint('vote_option_discord_participant', type_='unique')
+        batch_op.create_index('vote_option_discord_participant', ['option_id', 'discord_participant_id'])
+        batch_op.create_index('vote_option_participant_name', ['option_id', 'participant_name'])
@@ -0,0 +1,27 @@
+"""Add number of votes to options
+
+Revision ID: f2b6d84e1a07
+Revises: e5f0a3c27b14
+Create Date: 2026-10-17 15:48:37.260914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b6d84e1a07'
+down_revision = 'e5f0a3c27b14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Option', sa.Column('num_votes', sa.Integer(), server_default='0', nullable=False))
+
+    # Count the existing votes
+    op.execute('UPDATE "Option" SET num_votes = (SELECT COUNT(*) FROM "Vote" WHERE "Vote".option_id = "Option".id)')
+
+
+def downgrade():
+    op.drop_column('Option', 'num_votes')
@@ -2,7 +2,8 @@ import datetime
 
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy import Column, String, Integer, Boolean, ForeignKey, Date, DateTime, UniqueConstraint, BigInteger
+from sqlalchemy import Column, String, Integer, Boolean, ForeignKey, Date, DateTime, UniqueConstraint, BigInteger, \
+    Index
 
 # Base class for DB Classes
 base = declarative_base()
@@ -47,7 +48,11 @@ class Poll(base):
     discord_author_id = Column(BigInteger)
     discord_message_id = Column(BigInteger, unique=True)
 
-    __table_args__ = (UniqueConstraint('poll_key', 'discord_server_id', name='poll_composite_id'),)
+    # The unique constraint also serves the searches by poll_key
+    __table_args__ = (UniqueConstraint('poll_key', 'discord_server_id', name='poll_composite_id'),
+                      Index('poll_server_author', 'discord_server_id', 'discord_author_id'),
+                      Index('poll_channel', 'channel_id'),
+                      Index('poll_closed_date', 'closed_date'))
 
     options = relationship('Option', cascade='all,delete')
 
@@ -73,8 +78,13 @@ class Option(base):
     option_text = Column(String)
     locked = Column(Boolean)
 
+    # Kept up to date with the votes, so that they are not needed to show only their number
+    num_votes = Column(Integer, nullable=False, default=0, server_default='0')
+
     poll_id = Column(Integer, ForeignKey('Poll.id'))
 
+    __table_args__ = (Index('option_poll_position', 'poll_id', 'position'),)
+
     votes = relationship('Vote', cascade='all,delete')
 
     def __init__(self, poll_id, position, option_text, locked=False):
@@ -82,6 +92,7 @@ class Option(base):
         self.position = position
         self.option_text = option_text
         self.locked = locked
+        self.num_votes = 0
 
 
 class Vote(base):
@@ -95,6 +106,10 @@ class Vote(base):
 
     option_id = Column(Integer, ForeignKey('Option.id'))
 
+    # A participant votes only once in each option, discord users have no name and external participants no id
+    __table_args__ = (UniqueConstraint('option_id', 'discord_participant_id', name='vote_option_discord_participant'),
+                      UniqueConstraint('option_id', 'participant_name', name='vote_option_participant_name'))
+
     def __init__(self, option_id, discord_participant_id, participant_name):
         self.option_id = option_id
         self.discord_participant_id = discord_participant_id
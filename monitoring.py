@@ -0,0 +1,96 @@
+import logging
+import time
+
+from aiohttp import web
+from sqlalchemy import event
+
+import configuration as config
+import metrics
+
+handler_durations = metrics.Histogram('handler_duration_seconds',
+                                      'Time taken to handle the events and commands, in seconds.', 'handler')
+query_durations = metrics.Histogram('db_query_duration_seconds', 'Time taken by the queries to the DB, in seconds.',
+                                    'statement')
+request_durations = metrics.Histogram('discord_request_duration_seconds',
+                                      'Time taken by the requests to the Discord API, in seconds.', 'route')
+maintenance_durations = metrics.Histogram('maintenance_duration_seconds',
+                                          'Time taken by the jobs of the maintenance loop, in seconds.', 'job',
+                                          buckets=(1, 5, 15, 60, 300, 900, 3600))
+
+rate_limits = metrics.Counter('discord_rate_limits', 'Number of requests to the Discord API that were rate limited.')
+
+# The server of the metrics, once started
+runner = None
+
+
+@event.listens_for(config.engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(config.engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    query_durations.observe(statement.split(None, 1)[0].upper(), time.perf_counter() - conn.info['query_start'].pop())
+
+
+@event.listens_for(config.engine, 'handle_error')
+def handle_error(exception_context):
+    # The query failed, so it is not measured
+    if exception_context.connection is not None and exception_context.connection.info.get('query_start'):
+        exception_context.connection.info['query_start'].pop()
+
+
+def instrument_requests(http):
+    """
+    Measure the requests made by the HTTP client of discord.py, by route.
+
+    :param http: the HTTP client.
+    """
+
+    request = http.request
+
+    async def timed_request(route, **kwargs):
+        with request_durations.time('%s %s' % (route.method, route.path)):
+            return await request(route, **kwargs)
+
+    http.request = timed_request
+
+
+def count_rate_limits(record):
+    """Count the rate limits reported in the logs of discord.py, which waits for them and tries again."""
+
+    # Logged for every 429, a global one also logs a second message that is not counted
+    if record.levelno == logging.WARNING and str(record.msg).startswith('We are being rate limited'):
+        rate_limits.inc()
+
+    return True
+
+
+instrument_requests(config.client.http)
+
+# A filter, unlike a handler, keeps the default output of the logs
+logging.getLogger('discord.http').addFilter(count_rate_limits)
+
+
+async def serve_metrics(request):
+    return web.Response(body=metrics.render().encode(),
+                        headers={'Content-Type': 'application/openmetrics-text; version=1.0.0; charset=utf-8'})
+
+
+async def start_server():
+    """Serve the metrics over HTTP, if it is enabled and not yet running."""
+
+    global runner
+
+    if config.metrics_port is None or runner is not None:
+        return
+
+    app = web.Application()
+    app.router.add_get('/metrics', serve_metrics)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+
+    await web.TCPSite(runner, config.METRICS_HOST, config.metrics_port).start()
+
+    print('Metrics served at http://%s:%d/metrics' % (config.METRICS_HOST, config.metrics_port))
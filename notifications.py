@@ -0,0 +1,64 @@
+import discord
+
+import configuration as config
+import monitoring
+import workers
+
+# Worker for the private messages sent to the members
+sender = workers.Worker('notifications', config.CONCURRENT_NOTIFICATIONS, config.NOTIFICATION_INTERVAL_SEC)
+
+
+async def send(member, message):
+    """
+    Send a private message to a member.
+
+    :param member: the member.
+    :param message: the message.
+    """
+
+    rate_limits = monitoring.rate_limits.value
+
+    try:
+        await member.send(message)
+    except discord.errors.HTTPException:
+        pass
+
+    # Wait before sending more messages when the bot is being rate limited
+    # discord.py waits for the rate limits and tries again by itself, so they are only seen in the logs it writes
+    if monitoring.rate_limits.value > rate_limits:
+        sender.pause(config.NOTIFICATION_RATE_LIMIT_PAUSE_SEC)
+
+
+def notify(poll_id, member, message):
+    """
+    Send a private message about a poll to a member, in the background.
+
+    :param poll_id: the id of the poll in the DB.
+    :param member: the member.
+    :param message: the message.
+    """
+
+    sender.submit(send, member, message, key=poll_id)
+
+
+def notify_new_poll(poll, channel):
+    """
+    Send a private message to every member in the channel of a new poll, in the background.
+
+    :param poll: the models.Poll entry from the DB.
+    :param channel: the channel where the poll was created.
+    """
+
+    for m in channel.members:
+        if m != config.client.user and m.id != poll.discord_author_id:
+            notify(poll.id, m, 'A new poll (%s) has been created in %s!' % (poll.poll_key, channel.mention))
+
+
+def cancel(poll_id):
+    """
+    Cancel the private messages about a poll that are yet to be sent.
+
+    :param poll_id: the id of the poll in the DB.
+    """
+
+    sender.cancel(poll_id)
@@ -1,12 +1,23 @@
+import time
+
+# Measure the startup from before the imports
+start_time = time.perf_counter()
+
 import asyncio
 
 import discord
 
 import auxiliary
+import cache
 import commands
 import configuration as config
+import database
+import edits
 import interactive
-import models
+import monitoring
+import profiling
+
+config.startup_times['Imports'] = time.perf_counter() - start_time - sum(config.startup_times.values())
 
 
 # When the bot is ready to work
@@ -14,35 +25,95 @@ import models
 async def on_ready():
     print('The bot is ready to poll!\n-------------------------')
 
-    refreshed = False
+    # Report the duration of the startup, only the first time
+    if config.startup_times:
+        config.startup_times['Connect to Discord'] = time.perf_counter() - start_time \
+                                                     - sum(config.startup_times.values())
+
+        for step, duration in config.startup_times.items():
+            print('%s: %.3fs' % (step, duration))
+
+        print('Total startup: %.3fs\n-------------------------' % sum(config.startup_times.values()))
+
+        config.startup_times.clear()
+
+    await monitoring.start_server()
+
+    # Reactions to messages that are not polls can then be ignored without the DB
+    await load_poll_messages()
+
+    last_audit = None
 
     while True:
-        # Check if the messages still exist
-        await auxiliary.check_messages_exist()
+        # Check if the messages still exist, in case a deletion was missed
+        audit = last_audit is None or time.monotonic() - last_audit >= config.TIME_BETWEEN_AUDITS_SEC
+
+        if audit:
+            last_audit = time.monotonic()
+
+        await run_maintenance(audit)
 
-        # Delete old closed polls
+        await asyncio.sleep(config.TIME_BETWEEN_CHECKS_SEC)
+
+
+@database.unit_of_work
+async def load_poll_messages():
+    """Load the ids of the messages of the polls."""
+
+    await database.run(auxiliary.load_poll_messages)
+
+
+@database.unit_of_work
+async def run_maintenance(audit):
+    """
+    Run the maintenance jobs, each time with a new session.
+
+    :param audit: whether to check that the messages and channels still exist.
+    """
+
+    if audit:
+        with monitoring.maintenance_durations.time('check_messages_exist'):
+            await auxiliary.check_messages_exist()
+
+    # Delete old closed polls
+    with monitoring.maintenance_durations.time('delete_old_closed_polls'):
         await auxiliary.delete_old_closed_polls()
 
-        if not refreshed:
-            refreshed = True
-            await auxiliary.refresh_all_polls()
+    # Fix the number of votes of the options that went out of sync
+    with monitoring.maintenance_durations.time('repair_num_votes'):
+        repaired = await database.run(auxiliary.repair_num_votes)
 
-        config.session.commit()
+    if repaired > 0:
+        print('Number of votes of %d options repaired!' % repaired)
 
-        await asyncio.sleep(config.TIME_BETWEEN_CHECKS_SEC)
+    await database.run(config.session.commit)
 
 
 # When a message is written in Discord
 @config.client.event
+@monitoring.handler_durations.timed
+@database.unit_of_work
 async def on_message(message):
-    # Get the channel information from the DB
-    db_channel = config.session.query(models.Channel).filter(models.Channel.discord_id == message.channel.id).first()
+    # Get the channel information from the cache, or the DB when it is not there
+    db_channel = cache.channels.get(message.channel.id)
+
+    if db_channel is cache.NOT_CACHED:
+        db_channel = await database.run(auxiliary.get_channel, message.channel.id)
 
     # If it is a reply
     if message.reference:
-        # Get the referenced message
-        c = config.client.get_channel(message.channel.id)
-        referenced_message = await c.fetch_message(message.reference.message_id)
+        # Ignore replies to messages that are not interactive messages of the bot
+        if not interactive.is_interactive_message(message.reference.message_id):
+            return
+
+        # Get the referenced message, from Discord only if it was not sent with the reply or cached
+        referenced_message = message.reference.resolved or message.reference.cached_message
+
+        if isinstance(referenced_message, discord.DeletedReferencedMessage):
+            return
+
+        if referenced_message is None:
+            referenced_message = await auxiliary.fetch_message(message.channel.id, message.reference.message_id)
 
         # If it was an interaction with one of the bot's messages
         if referenced_message.author == config.client.user:
@@ -89,97 +160,196 @@ async def on_message(message):
             pass
 
 
-# When a reaction is added in Discord
+# When a reaction is added in Discord, even to messages that are not in the cache of discord.py
 @config.client.event
-async def on_reaction_add(reaction: discord.reaction.Reaction, user):
-    if user == config.client.user:
+@monitoring.handler_durations.timed
+@profiling.query_budget(8)
+@database.unit_of_work
+async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
+    if payload.user_id == config.client.user.id or payload.emoji.is_custom_emoji():
         return
 
-    # Select the current poll
-    poll = config.session.query(models.Poll).filter(models.Poll.discord_message_id == reaction.message.id).first()
-
     # The reaction was to a message that is not a poll
-    if poll is None:
+    if not cache.poll_messages.may_be_poll(payload.message_id):
+        referenced_message = interactive.get_interactive_message(payload.message_id)
+
         # If it was an interaction with one of the bot's messages
-        if reaction.message.author == config.client.user:
-            await interactive.process_reaction(reaction)
+        if referenced_message is not None:
+            await interactive.process_reaction(payload.emoji.name, referenced_message)
 
         return
 
+    # Select the current poll
+    poll = await database.run(auxiliary.get_poll_by_message, payload.message_id)
+
+    if poll is None:
+        return
+
     # Get the number of the vote
-    option = ord(reaction.emoji[0]) - 48
+    option = ord(payload.emoji.name[0]) - 48
 
     if option > 9:
         return
 
     # Get all options available in the poll
-    db_options = config.session.query(models.Option).filter(models.Option.poll_id == poll.id) \
-        .order_by(models.Option.position).all()
-
-    # Get the channel information from the DB
-    db_channel = config.session.query(models.Channel).filter(models.Channel.discord_id == reaction.message.channel.id) \
-        .first()
+    db_options = poll.options
 
-    poll_edited = auxiliary.add_vote(option, user.id, db_options, poll.multiple_options)
+    poll_edited = await database.run(auxiliary.add_vote, option, payload.user_id, db_options,
+                                     poll.multiple_options)
 
-    # Edit the message
+    # Edit the message, together with the other votes that arrive shortly after
     if poll_edited:
-        c = config.client.get_channel(db_channel.discord_id)
-
-        try:
-            m = await c.fetch_message(poll.discord_message_id)
-            await m.edit(content=auxiliary.create_message(poll, db_options))
-        except discord.errors.NotFound:
-            config.session.delete(poll)
+        await database.run(config.session.commit)
 
-        config.session.commit()
+        edits.scheduler.schedule(poll.id, payload.channel_id)
 
-        print('%s reacted with %d in %s!' % (user.id, option, poll.poll_key))
+        print('%s reacted with %d in %s!' % (payload.user_id, option, poll.poll_key))
 
 
-# When a reaction is removed in Discord
+# When a reaction is removed in Discord, even from messages that are not in the cache of discord.py
 @config.client.event
-async def on_reaction_remove(reaction, user):
-    if user == config.client.user:
+@monitoring.handler_durations.timed
+@profiling.query_budget(6)
+@database.unit_of_work
+async def on_raw_reaction_remove(payload: discord.RawReactionActionEvent):
+    if payload.user_id == config.client.user.id or payload.emoji.is_custom_emoji():
+        return
+
+    # The reaction was to a message that is not a poll
+    if not cache.poll_messages.may_be_poll(payload.message_id):
         return
 
     # Select the current poll
-    poll = config.session.query(models.Poll).filter(models.Poll.discord_message_id == reaction.message.id).first()
+    poll = await database.run(auxiliary.get_poll_by_message, payload.message_id)
 
-    # The reaction was to a message that is not a poll
     if poll is None:
         return
 
     # Get the number of the vote
-    option = ord(reaction.emoji[0]) - 48
+    option = ord(payload.emoji.name[0]) - 48
 
     if option > 9:
         return
 
     # Get all options available in the poll
-    db_options = config.session.query(models.Option).filter(models.Option.poll_id == poll.id) \
-        .order_by(models.Option.position).all()
+    db_options = poll.options
 
-    # Get the channel information from the DB
-    db_channel = config.session.query(models.Channel).filter(models.Channel.discord_id == reaction.message.channel.id) \
-        .first()
+    poll_edited = await database.run(auxiliary.remove_vote, option, payload.user_id, db_options)
 
-    poll_edited = auxiliary.remove_vote(option, user.id, db_options)
+    # Edit the message, together with the other votes that arrive shortly after
+    if poll_edited:
+        await database.run(config.session.commit)
+
+        edits.scheduler.schedule(poll.id, payload.channel_id)
+
+        print('%s removed reaction %d from %s!' % (payload.user_id, option, poll.poll_key))
+
+
+# When an event is received from Discord, for the interactions that discord.py does not support
+@config.client.event
+async def on_socket_response(msg):
+    if msg.get('t') != 'INTERACTION_CREATE':
+        return
+
+    interaction = msg['d']
+
+    # Only clicks in the buttons of polls
+    if interaction['type'] == 3 and interaction['data'].get('custom_id', '').startswith('vote:'):
+        await on_vote_button(interaction)
+
+
+@monitoring.handler_durations.timed
+@profiling.query_budget(10)
+@database.unit_of_work
+async def on_vote_button(interaction):
+    """
+    Add or remove the vote of the member that clicked the button of an option.
+
+    :param interaction: the interaction, in the format of the Discord API.
+    """
+
+    await auxiliary.acknowledge_interaction(interaction)
+
+    # Select the current poll
+    poll = await database.run(auxiliary.get_poll_by_message, int(interaction['message']['id']))
+
+    if poll is None or poll.closed:
+        return
+
+    option = int(interaction['data']['custom_id'][5:])
+    user_id = int(interaction['member']['user']['id'] if 'member' in interaction else interaction['user']['id'])
+
+    # Get all options available in the poll
+    db_options = poll.options
+
+    # The button removes the vote when the member had already voted in the option
+    poll_edited = await database.run(auxiliary.remove_vote, option, user_id, db_options)
 
-    # Edit the message
+    if not poll_edited:
+        poll_edited = await database.run(auxiliary.add_vote, option, user_id, db_options, poll.multiple_options)
+
+    # Edit the message, together with the other votes that arrive shortly after
     if poll_edited:
-        c = config.client.get_channel(db_channel.discord_id)
+        await database.run(config.session.commit)
 
-        try:
-            m = await c.fetch_message(poll.discord_message_id)
-            await m.edit(content=auxiliary.create_message(poll, db_options))
-        except discord.errors.NotFound:
-            config.session.delete(poll)
+        edits.scheduler.schedule(poll.id, int(interaction['channel_id']))
 
-        config.session.commit()
+        print('%s clicked %d in %s!' % (user_id, option, poll.poll_key))
+
+
+# When a message is deleted in Discord, even if it is not in the cache of discord.py
+@config.client.event
+@monitoring.handler_durations.timed
+@database.unit_of_work
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    poll_id = cache.poll_messages.get(payload.message_id)
+
+    # Delete the poll of the message
+    if poll_id is not None:
+        await database.run(auxiliary.delete_poll_by_id, poll_id)
+        await database.run(config.session.commit)
+
+        print('Poll %d deleted with its message!' % poll_id)
+
+
+# When multiple messages are deleted in Discord at once
+@config.client.event
+@monitoring.handler_durations.timed
+@database.unit_of_work
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    poll_ids = [cache.poll_messages.get(message_id) for message_id in payload.message_ids]
+    poll_ids = [poll_id for poll_id in poll_ids if poll_id is not None]
 
-        print('%s removed reaction %d from %s!' % (user.id, option, poll.poll_key))
+    # Delete the polls of the messages
+    for poll_id in poll_ids:
+        await database.run(auxiliary.delete_poll_by_id, poll_id)
+
+    if poll_ids:
+        await database.run(config.session.commit)
+
+        print('Polls %s deleted with their messages!' % poll_ids)
+
+
+# When a channel is deleted in Discord
+@config.client.event
+@monitoring.handler_durations.timed
+@database.unit_of_work
+async def on_guild_channel_delete(channel):
+    # Channels that are known not to be in the DB need nothing
+    if cache.channels.get(channel.id) is None:
+        return
+
+    await database.run(auxiliary.delete_channels, [channel.id])
+
+
+# When the bot is removed from a server
+@config.client.event
+@monitoring.handler_durations.timed
+@database.unit_of_work
+async def on_guild_remove(guild):
+    await database.run(auxiliary.delete_server_channels, guild.id)
 
 
-# Run the bot
-config.client.run(config.token)
+# Run the bot, unless the handlers are only being imported, as by the benchmarks
+if __name__ == '__main__':
+    config.client.run(config.token)
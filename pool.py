@@ -0,0 +1,36 @@
+import time
+
+from sqlalchemy.pool import QueuePool
+
+import metrics
+
+checkouts = metrics.Counter('db_pool_checkouts', 'Number of connections taken from the pool.')
+checkout_wait = metrics.Counter('db_pool_checkout_wait_seconds',
+                                'Total time spent waiting for a connection from the pool, in seconds.')
+checkout_failures = metrics.Counter('db_pool_checkout_failures',
+                                    'Number of times a connection could not be taken from the pool.')
+
+
+class TimedQueuePool(QueuePool):
+    """Pool of connections that measures how long each checkout waits for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # The pool is recreated when the engine is disposed, the gauge then follows the new pool
+        metrics.Gauge('db_pool_checked_out', 'Number of connections of the pool in use.', self.checkedout)
+
+    def _do_get(self):
+        start = time.perf_counter()
+
+        try:
+            connection = super()._do_get()
+        except Exception:
+            checkout_failures.inc()
+            raise
+        finally:
+            checkout_wait.inc(time.perf_counter() - start)
+
+        checkouts.inc()
+
+        return connection
@@ -0,0 +1,138 @@
+import contextvars
+import functools
+import time
+
+from sqlalchemy import event
+
+import configuration as config
+import metrics
+
+event_queries = metrics.Histogram('event_queries', 'Number of queries to the DB made by each event.', 'handler',
+                                  buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+budgets_exceeded = metrics.Counter('query_budgets_exceeded',
+                                   'Number of events that made more queries to the DB than their budget.')
+duplicate_queries = metrics.Counter('duplicate_queries',
+                                    'Number of queries repeated with the same parameters in the same event.')
+
+# The queries of the event running
+current_event = contextvars.ContextVar('current_event', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    """An event made more queries to the DB than its budget, raised in strict mode."""
+
+
+class EventQueries:
+    """The queries made to the DB by an event."""
+
+    def __init__(self, name, budget, parent):
+        """
+        :param name: the name of the event.
+        :param budget: the maximum number of queries.
+        :param parent: the EventQueries of the event that is running this one, or None.
+        """
+
+        self.name = name
+        self.budget = budget
+        self.parent = parent
+
+        # The statement, its parameters and its duration, of each query
+        self.queries = []
+
+        # Tasks started by the event may still make queries after it finishes
+        self.finished = False
+
+    def add(self, statement, parameters, duration):
+        """
+        Add a query to this event and to the events running it.
+
+        :param statement: the SQL statement.
+        :param parameters: the parameters of the statement.
+        :param duration: the duration of the query, in seconds.
+        """
+
+        entry = self
+
+        while entry is not None and not entry.finished:
+            entry.queries.append((statement, parameters, duration))
+            entry = entry.parent
+
+    def num_duplicates(self):
+        """Get the number of queries that repeat a previous query of the event."""
+
+        return len(self.queries) - len({(statement, repr(parameters)) for statement, parameters, _ in self.queries})
+
+    def report(self):
+        """Get the summary of the queries of the event."""
+
+        return '%s: %d queries (budget %d) in %.1f ms, %d duplicates' \
+               % (self.name, len(self.queries), self.budget, sum(d for _, _, d in self.queries) * 1000,
+                  self.num_duplicates())
+
+
+@event.listens_for(config.engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('profiling_start', []).append(time.perf_counter())
+
+
+@event.listens_for(config.engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['profiling_start'].pop()
+
+    # The DB threads run with the context of the event
+    queries = current_event.get()
+
+    if queries is not None:
+        queries.add(statement, parameters, duration)
+
+
+@event.listens_for(config.engine, 'handle_error')
+def handle_error(exception_context):
+    # The query failed, so it is not recorded
+    if exception_context.connection is not None and exception_context.connection.info.get('profiling_start'):
+        exception_context.connection.info['profiling_start'].pop()
+
+
+def query_budget(budget):
+    """
+    Decorate a coroutine function, such as the handler of an event or a command, to record its queries to the DB.
+    The queries that go over the budget or repeat a previous query are reported, in strict mode an event over the
+    budget raises QueryBudgetExceeded.
+
+    :param budget: the maximum number of queries of each call.
+    :return: the decorator.
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            queries = EventQueries(handler.__name__, budget, current_event.get())
+            token = current_event.set(queries)
+
+            try:
+                result = await handler(*args, **kwargs)
+            finally:
+                queries.finished = True
+                current_event.reset(token)
+
+            event_queries.observe(queries.name, len(queries.queries))
+
+            num_duplicates = queries.num_duplicates()
+
+            if num_duplicates > 0:
+                duplicate_queries.inc(num_duplicates)
+
+            if len(queries.queries) > budget:
+                budgets_exceeded.inc()
+
+                if config.strict_query_budgets:
+                    raise QueryBudgetExceeded(queries.report())
+
+            if len(queries.queries) > budget or num_duplicates > 0:
+                print('Queries of %s' % queries.report())
+
+            return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,151 @@
+from typing import List
+
+# Text added after the voters shown when some are left out
+MORE_VOTERS = ' and %d more'
+
+
+class OptionLine:
+    """The parts of the line of an option in the message of a poll."""
+
+    def __init__(self, option, votes, max_names=None):
+        """
+        :param option: the option.
+        :param votes: the participants that voted in the option, or their number when only that is shown.
+        :param max_names: the maximum number of names that can be shown, or None for no limit.
+        """
+
+        if type(votes) == int:
+            self.num_votes = votes
+            votes = []
+        else:
+            self.num_votes = len(votes)
+
+        self.start = '\n%d - %s' % (option.position, option.option_text)
+
+        if self.num_votes > 0:
+            self.start += ': %d votes' % self.num_votes
+
+        self.end = ' (locked)' if option.locked else ''
+
+        # Check the type of participant
+        # int means discord user
+        # string means external participant
+        self.names = [' %s' % p if type(p) == str else ' <@%s>' % p for p in votes[:max_names]]
+        self.names_length = sum(len(name) for name in self.names)
+
+        # Number of names shown, all by default
+        self.shown = len(self.names)
+
+    def write(self, parts: List[str], counts_only: bool):
+        """
+        Add the parts of the line to the message.
+
+        :param parts: the parts of the message.
+        :param counts_only: whether to show only the number of voters.
+        """
+
+        parts.append(self.start)
+
+        if self.num_votes > 0:
+            # Show the number of voters for the option
+            if counts_only or self.shown == 0:
+                parts.append('.')
+            # Show the names of the voters for the option
+            else:
+                parts.append(' ->')
+                parts.extend(self.names[:self.shown])
+
+                if self.shown < self.num_votes:
+                    parts.append(MORE_VOTERS % (self.num_votes - self.shown))
+
+        parts.append(self.end)
+
+
+def render(poll, options, all_votes, max_length=None):
+    """
+    Render the message of a poll in a single pass, in time linear in the number of voters.
+    When the message would be longer than the limit, only some of the voters of each option are shown and, if that is
+    not enough, only the number of voters.
+
+    :param poll: the poll.
+    :param options: the options available in the poll.
+    :param all_votes: the participants that voted in each option, or their number when only that is shown, by option id.
+    :param max_length: the maximum length of the message, or None for no limit.
+    :return: the message that represents the poll.
+    """
+
+    header = '**%s** (poll_key: %s) (author: <@%s>)' % (poll.question, poll.poll_key, poll.discord_author_id)
+
+    if poll.closed:
+        header += ' (Closed)'
+
+    footer = ''
+
+    if not poll.closed:
+        if poll.new_options:
+            footer += '\n(New options allowed!)'
+
+        if poll.multiple_options:
+            footer += '\n(Multiple options allowed!)'
+
+        if poll.allow_external:
+            footer += '\n(External voters allowed!)'
+
+    # Names take at least 2 characters, no more than these can be shown
+    max_names = None if max_length is None else max_length // 2
+
+    lines = [OptionLine(option, all_votes[option.id], max_names) for option in options]
+    voted = [line for line in lines if line.num_votes > 0]
+
+    # Length of the message when only the number of voters is shown
+    counts_length = len(header) + len(footer) + len(voted) + sum(len(line.start) + len(line.end) for line in lines)
+
+    counts_only = poll.only_numbers
+
+    if not counts_only and max_length is not None:
+        names_length = sum(line.names_length for line in voted)
+
+        # Less than all the names fit, give each option an equal share of the space left
+        if counts_length + names_length + 2 * len(voted) > max_length \
+                or any(len(line.names) < line.num_votes for line in voted):
+            available = max_length - counts_length
+
+            # The options that need less space first, so that the space they do not use goes to the others
+            by_need = sorted(voted, key=lambda line: line.names_length)
+
+            for i, line in enumerate(by_need):
+                share = available // (len(voted) - i)
+
+                # All the voters fit, replacing the '.' with ' ->'
+                if len(line.names) == line.num_votes and 2 + line.names_length <= share:
+                    available -= 2 + line.names_length
+                    continue
+
+                # Replace the '.' with ' ->' and leave room for the voters left out
+                used = 2 + len(MORE_VOTERS % line.num_votes)
+                line.shown = 0
+
+                for name in line.names:
+                    if used + len(name) > share:
+                        break
+
+                    used += len(name)
+                    line.shown += 1
+
+                if line.shown > 0:
+                    available -= used
+
+    parts = [header]
+
+    for line in lines:
+        line.write(parts, counts_only)
+
+    parts.append(footer)
+
+    msg = ''.join(parts)
+
+    # Not even the number of voters fit, cut the message
+    if max_length is not None and len(msg) > max_length:
+        msg = msg[:max_length - 3] + '...'
+
+    return msg
@@ -0,0 +1,51 @@
+import alembic.command as alecomm
+import alembic.config as aleconf
+import alembic.migration as alemig
+import alembic.script as alescript
+
+from sqlalchemy import inspect
+
+import models
+
+MIGRATIONS_DIR = './migrations/'
+
+
+def get_alembic_config(database_url):
+    """
+    Create the configuration used by alembic.
+
+    :param database_url: the url of the database.
+    :return: the alembic configuration.
+    """
+
+    config = aleconf.Config(file_='%salembic.ini' % MIGRATIONS_DIR)
+    config.set_main_option('script_location', MIGRATIONS_DIR)
+    config.set_main_option('sqlalchemy.url', database_url)
+
+    return config
+
+
+def check(connection, alembic_config):
+    """
+    Check that the version of the database is the latest migration, without changing it.
+    An empty database gets all tables created and is marked with the latest version.
+
+    :param connection: the connection to the database.
+    :param alembic_config: the alembic configuration.
+    :return: True if the database is up to date.
+    """
+
+    current = alemig.MigrationContext.configure(connection).get_current_revision()
+    head = alescript.ScriptDirectory.from_config(alembic_config).get_current_head()
+
+    if current == head:
+        return True
+
+    # A fresh install does not need to go through all migrations
+    if current is None and not inspect(connection).get_table_names():
+        models.base.metadata.create_all(connection)
+        alecomm.stamp(alembic_config, 'head')
+
+        return True
+
+    return False
@@ -0,0 +1,112 @@
+import asyncio
+
+import metrics
+
+
+class Worker:
+    """
+    Runs jobs in the background, with a maximum number of jobs running at the same time and an optional pause
+    between jobs.
+    """
+
+    def __init__(self, name, concurrency, interval_sec=0):
+        """
+        :param name: the name of the worker, used in the logs and metrics.
+        :param concurrency: the maximum number of jobs running at the same time.
+        :param interval_sec: the time each job waits after the previous one, in seconds.
+        """
+
+        self.name = name
+        self.concurrency = concurrency
+        self.interval_sec = interval_sec
+
+        self.queue = None
+        self.tasks = []
+
+        # Keys of the jobs that were cancelled
+        self.cancelled = set()
+
+        # Time until which no jobs are started
+        self.paused_until = 0
+
+        self.jobs_queued = metrics.Counter('%s_jobs_queued' % name, 'Number of jobs queued in %s.' % name)
+        self.jobs_done = metrics.Counter('%s_jobs_done' % name, 'Number of jobs done by %s.' % name)
+        self.jobs_failed = metrics.Counter('%s_jobs_failed' % name, 'Number of jobs that failed in %s.' % name)
+        self.jobs_cancelled = metrics.Counter('%s_jobs_cancelled' % name,
+                                              'Number of jobs cancelled in %s.' % name)
+
+        metrics.Gauge('%s_queue_size' % name, 'Number of jobs waiting in %s.' % name,
+                      lambda: self.queue.qsize() if self.queue is not None else 0)
+
+    def submit(self, func, *args, key=None):
+        """
+        Add a job to the queue.
+
+        :param func: the coroutine function of the job.
+        :param args: the arguments of the function.
+        :param key: the key used to cancel the job.
+        """
+
+        # Start when the first job arrives, so that it runs in the loop of the client
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+            self.tasks = [asyncio.create_task(self.consume()) for _ in range(self.concurrency)]
+
+        self.jobs_queued.inc()
+        self.queue.put_nowait((func, args, key))
+
+    def cancel(self, key):
+        """
+        Cancel all jobs with a key that are still in the queue.
+
+        :param key: the key of the jobs.
+        """
+
+        if self.queue is not None and not self.queue.empty():
+            self.cancelled.add(key)
+
+    def pause(self, time_sec):
+        """
+        Stop starting jobs for some time, when being rate limited.
+
+        :param time_sec: the duration of the pause, in seconds.
+        """
+
+        self.paused_until = max(self.paused_until, asyncio.get_running_loop().time() + time_sec)
+
+    async def join(self):
+        """Wait until all jobs in the queue are done."""
+
+        if self.queue is not None:
+            await self.queue.join()
+
+    async def consume(self):
+        """Run the jobs in the queue, one at a time."""
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            func, args, key = await self.queue.get()
+
+            try:
+                if key is not None and key in self.cancelled:
+                    self.jobs_cancelled.inc()
+                    continue
+
+                if self.paused_until > loop.time():
+                    await asyncio.sleep(self.paused_until - loop.time())
+
+                await func(*args)
+                self.jobs_done.inc()
+
+                if self.interval_sec > 0:
+                    await asyncio.sleep(self.interval_sec)
+            except Exception as e:
+                self.jobs_failed.inc()
+                print('Job of %s failed: %r' % (self.name, e))
+            finally:
+                self.queue.task_done()
+
+                # The cancelled jobs are gone
+                if self.queue.empty():
+                    self.cancelled.clear()